@@ -0,0 +1,247 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The analytics module calculates performance across many sessions of a
+round log: the P/L distribution, how accurately players report their P/L,
+the edge captured relative to the EV of the market maker quote and the
+drawdowns of the balance.
+
+Round records are loaded as NumPy columns, memory-mapped for binary logs
+if asked, and every aggregate is calculated on whole columns. Group-bys
+by session (player) or deck label each record with its group and add up
+the columns per group with bincount, so no Python code runs per round.
+
+Usage:
+    python analytics.py LOG                     Summary of every round
+    python analytics.py LOG --by session        Summary of each session
+    python analytics.py LOG --by deck --mmap    Summary of each deck with
+                                                the log memory-mapped
+"""
+import argparse
+import json
+
+import numpy as np
+
+from recorder import FIELDS, NO_CARD, load_columns, log_format, record_dtype
+
+GROUP_KEYS = ('session', 'deck')
+
+# Quantiles of the P/L distribution in the summary
+PL_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def load_rounds(path: str, mmap: bool = False, session: int = None) -> np.ndarray:
+    """
+    Loads a round log as a structured array with one column per field.
+    :param path:    The log file path
+    :param mmap:    Memory-map a binary log (True) or read it into memory
+                    (False). JSON lines logs are always read into memory.
+    :param session: Only the records of this session if given
+    :return:        Structured array of records with the dtype of a binary log
+    """
+    if log_format(path) == 'bin':
+        records = load_columns(path, mmap)
+    else:
+        records = load_jsonl_columns(path)
+    if session is not None:
+        records = records[records['session'] == session]
+    return records
+
+
+def load_jsonl_columns(path: str) -> np.ndarray:
+    """
+    Loads a JSON lines round log as a structured array, padding the cards
+    of shorter rounds as the binary format does.
+    """
+    rows = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                rows.append(json.loads(line))
+    cards_per_round = max((len(row['cards']) for row in rows), default=0)
+    records = np.zeros(len(rows), dtype=record_dtype(cards_per_round))
+    for field in FIELDS:
+        if field == 'cards':
+            continue
+        records[field] = [row[field] for row in rows]
+    records['cards'] = [row['cards'] + [NO_CARD] * (cards_per_round - len(row['cards']))
+                        for row in rows]
+    return records
+
+
+def expected_edge(records: np.ndarray) -> np.ndarray:
+    """
+    Calculates the edge of each order at the EV it was quoted on, i.e. the
+    expected P/L of buying at the ask or selling at the bid.
+    :return: Array of the expected P/L of each round, 0 for passes
+    """
+    order = records['order'].astype(np.int64)
+    price = np.where(order > 0, records['ask'], records['bid'])
+    return order * (records['ev'] - price) * records['units']
+
+
+def drawdowns(records: np.ndarray) -> np.ndarray:
+    """
+    Calculates the drawdown of the balance after each round, the fall from
+    the highest balance of its session so far, with the start balance of
+    the session's first round as its first high.
+    :param records: Records with the rounds of each session in log order
+    :return:        Array of the drawdown after each round in record order
+    """
+    count = len(records)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Sort by session keeping the log order of rounds within a session
+    order = np.argsort(records['session'], kind='stable')
+    sessions = records['session'][order]
+    end_bal = records['end_bal'][order].astype(np.int64)
+    start_bal = records['start_bal'][order].astype(np.int64)
+    is_first = np.empty(count, dtype=bool)
+    is_first[0] = True
+    is_first[1:] = sessions[1:] != sessions[:-1]
+
+    # Each session is shifted above every earlier session so one running max
+    # over every record never carries a high into the next session
+    high = np.where(is_first, np.maximum(start_bal, end_bal), end_bal)
+    low = min(end_bal.min(), start_bal.min())
+    span = int(max(high.max(), start_bal.max()) - low) + 1
+    offset = (np.cumsum(is_first) - 1) * span - low
+    peak = np.maximum.accumulate(high + offset) - offset
+
+    drawdown = np.empty(count, dtype=np.int64)
+    drawdown[order] = peak - end_bal
+    return drawdown
+
+
+def summarize(records: np.ndarray, bins: int = 20) -> dict:
+    """
+    Calculates the aggregates of every record.
+    :param records: Structured array of records e.g. from load_rounds
+    :param bins:    The number of bins of the P/L histogram
+    :return:        Dictionary of aggregates which can be written as JSON
+    """
+    true_pl = records['true_pl'].astype(np.int64)
+    is_trade = records['order'] != 0
+    trades = int(is_trade.sum())
+    trade_pl = true_pl[is_trade]
+    error = (records['input_pl'].astype(np.int64) - true_pl)[is_trade]
+    edge = expected_edge(records)
+    counts, edges = np.histogram(trade_pl, bins=bins) if trades else (np.zeros(0), np.zeros(0))
+
+    return {'rounds': len(records),
+            'sessions': len(np.unique(records['session'])),
+            'trades': trades,
+            'total_pl': int(true_pl.sum()),
+            'mean_pl': float(trade_pl.mean()) if trades else 0.0,
+            'std_pl': float(trade_pl.std()) if trades else 0.0,
+            'win_rate': float((trade_pl > 0).mean()) if trades else 0.0,
+            'pl_quantiles': ({str(q): float(value) for q, value
+                              in zip(PL_QUANTILES, np.quantile(trade_pl, PL_QUANTILES))}
+                             if trades else {}),
+            'pl_histogram': {'counts': counts.tolist(), 'edges': edges.tolist()},
+            'report_accuracy': float((error == 0).mean()) if trades else 0.0,
+            'report_mean_abs_error': float(np.abs(error).mean()) if trades else 0.0,
+            'expected_edge': float(edge.sum()),
+            'edge_captured': float(true_pl.sum() / edge.sum()) if edge.sum() else 0.0,
+            'max_drawdown': int(drawdowns(records).max(initial=0))}
+
+
+def group_by(records: np.ndarray, key: str = 'session') -> dict[str, np.ndarray]:
+    """
+    Calculates the aggregates of each group of records. The drawdown of a
+    deck is the largest drawdown of a session played with the deck.
+    :param records: Structured array of records e.g. from load_rounds
+    :param key:    'session' for each player or 'deck' for each deck
+    :return:        Dictionary of column name to array with one element per
+                    group, sorted by the key
+    """
+    if key not in GROUP_KEYS:
+        raise ValueError(f'Group key must be one of {", ".join(GROUP_KEYS)}')
+    keys, group = np.unique(records[key], return_inverse=True)
+    group = group.ravel()
+    size = len(keys)
+
+    def total(weights) -> np.ndarray:
+        return np.bincount(group, weights=weights, minlength=size)
+
+    true_pl = records['true_pl'].astype(np.int64)
+    is_trade = records['order'] != 0
+    is_exact = is_trade & (records['input_pl'] == records['true_pl'])
+    rounds = np.bincount(group, minlength=size)
+    trades = total(is_trade)
+    pl = total(true_pl)
+    edge = total(expected_edge(records))
+    max_drawdown = np.zeros(size, dtype=np.int64)
+    np.maximum.at(max_drawdown, group, drawdowns(records))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {key: keys,
+                'rounds': rounds,
+                'trades': trades.astype(np.int64),
+                'total_pl': pl.astype(np.int64),
+                'mean_pl': np.where(trades > 0, pl / trades, 0.0),
+                'win_rate': np.where(trades > 0, total(is_trade & (true_pl > 0)) / trades, 0.0),
+                'report_accuracy': np.where(trades > 0, total(is_exact) / trades, 0.0),
+                'expected_edge': edge,
+                'edge_captured': np.where(edge != 0, pl / edge, 0.0),
+                'max_drawdown': max_drawdown}
+
+
+def print_summary(summary: dict) -> None:
+    print(f'Rounds:           {summary["rounds"]:,} in {summary["sessions"]:,} sessions')
+    print(f'Trades:           {summary["trades"]:,}')
+    print(f'Total P/L:        {summary["total_pl"]:,}')
+    print(f'Mean P/L:         {summary["mean_pl"]:.2f} (std {summary["std_pl"]:.2f})')
+    print(f'Win rate:         {summary["win_rate"]:.1%}')
+    if summary['pl_quantiles']:
+        print('P/L quantiles:   ', ' '.join(f'{q}={value:g}' for q, value
+                                             in summary['pl_quantiles'].items()))
+    print(f'Report accuracy:  {summary["report_accuracy"]:.1%} '
+          f'(mean abs error {summary["report_mean_abs_error"]:.2f})')
+    print(f'Expected edge:    {summary["expected_edge"]:,.1f} '
+          f'({summary["edge_captured"]:.1%} captured)')
+    print(f'Max drawdown:     {summary["max_drawdown"]:,}')
+
+
+def print_groups(groups: dict[str, np.ndarray], key: str, top: int = 20) -> None:
+    """
+    Prints the groups with the highest total P/L.
+    :param top: The number of groups printed
+    """
+    order = np.argsort(-groups['total_pl'], kind='stable')[:top]
+    print(f'{key:>10} {"rounds":>8} {"trades":>8} {"total P/L":>10} {"win":>6} '
+          f'{"accuracy":>9} {"edge":>9} {"captured":>9} {"drawdown":>9}')
+    for idx in order:
+        print(f'{groups[key][idx]:>10} {groups["rounds"][idx]:>8} {groups["trades"][idx]:>8} '
+              f'{groups["total_pl"][idx]:>10} {groups["win_rate"][idx]:>6.1%} '
+              f'{groups["report_accuracy"][idx]:>9.1%} {groups["expected_edge"][idx]:>9.1f} '
+              f'{groups["edge_captured"][idx]:>9.1%} {groups["max_drawdown"][idx]:>9}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Analyse the rounds of a round log')
+    parser.add_argument('log', help='round log, jsonl or bin')
+    parser.add_argument('--mmap', action='store_true', help='memory-map a binary log')
+    parser.add_argument('--session', type=int, default=None,
+                        help='only the rounds of this session')
+    parser.add_argument('--by', choices=GROUP_KEYS, default=None,
+                        help='summarize each session or deck')
+    parser.add_argument('--top', type=int, default=20,
+                        help='number of groups printed, highest total P/L first')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    records = load_rounds(args.log, args.mmap, args.session)
+    summary = summarize(records)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    if args.by:
+        print()
+        print_groups(group_by(records, args.by), args.by, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The batch module plays scripted games of the market making card game
+without a console, for regression and load testing. A script holds the
+answers a player would type, one per line, e.g.
+
+    # game 1
+    B,10
+    25
+    P
+    S,5
+    -5
+
+Blank lines and lines starting with # are skipped. Games follow the rules
+of game.main and are played one after another until the script or the
+number of games runs out. Game n plays with the random stream 'game/n' of
+the seed, so the same script and seed always give the same rounds. Each
+finished round is written to a round log with session first_session + n
+for game n, where first_session is a random session ID of the run, so runs
+appended to the same log do not share sessions.
+"""
+import argparse
+import sys
+import time
+from itertools import chain
+from typing import Iterable, Iterator
+
+import game
+import validation
+from cache import shared_cache
+from deck import DeckSpec
+from player import Player
+from recorder import ORDER_NAMES, RoundRecorder, new_session_id, read_records
+from streams import RandomStream
+
+BATCH_LOG = f'{game.DIR_PATH}/batch_log.jsonl'
+
+"""
+Class to represent the totals of a batch of scripted games.
+"""
+class BatchResult:
+    def __init__(self) -> None:
+        """
+        :param games:    The number of games started
+        :param finished: The number of games played to the end
+        :param rounds:   The number of rounds finished
+        :param invalid:  The number of answers which were not valid
+        :param rejected: The number of orders which exceeded the balance
+        :param elapsed:  The time taken in seconds
+        :param first_session: The session of game 1, game n is session 
+                              first_session + n - 1
+        """
+        self.games: int = 0
+        self.finished: int = 0
+        self.rounds: int = 0
+        self.invalid: int = 0
+        self.rejected: int = 0
+        self.elapsed: float = 0
+        self.first_session: int = 0
+
+    def games_per_second(self) -> float:
+        return self.games / self.elapsed if self.elapsed else 0
+
+
+def read_answers(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Streams the answers of a script.
+    :param lines: Lines of the script e.g. an open file
+    :return:      Iterator of answers
+    """
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def script_from_log(path: str, session: int = None) -> Iterator[str]:
+    """
+    Streams the answers of the rounds in a round log, so recorded sessions
+    can be replayed. Only the accepted order and P/L of each round are
+    recorded, not any Next answers.
+    :param path:    The log file path
+    :param session: Only the rounds of this session if given
+    :return:        Iterator of answers
+    """
+    for record in read_records(path, session):
+        order = ORDER_NAMES[record.order]
+        if order == 'Pass':
+            yield 'P'
+        else:
+            yield f'{order[0]},{record.units}'
+            yield str(record.input_pl)
+
+
+def play_game(answers: Iterator[str], spec: DeckSpec, rng: RandomStream,
+              result: BatchResult, recorder: RoundRecorder = None, session: int = 0,
+              deck: int = 0) -> bool:
+    """
+    Plays a game following the rules of game.main with answers from a script.
+    :param answers:  Iterator of answers, shared by every game of the batch
+    :param spec:     The compiled deck
+    :param rng:      Random number generator of the game
+    :param result:   Totals the game is added to
+    :param recorder: Round log each finished round is written to
+    :param session:  Session written to the round log
+    :param deck:     Deck written to the round log
+    :return:         True if the game was played to the end, False if the
+                     script ran out
+    """
+    game_deck, knowledge = game.new_game_deck(spec, rng)
+    player = Player(game.START_BALANCE)
+    seen_cards = set()
+    cache = shared_cache if game.CACHE else None
+
+    curr_round = 1
+    while curr_round <= game.ROUNDS and len(game_deck) > 0:
+        round = game.deal_round(curr_round, game_deck, spec, knowledge, seen_cards, cache,
+                                rng=rng)
+        round.show_round()
+        round.calculate_ev()
+        round.calculate_spread()
+        round.player_start_bal = player.balance
+
+        # Player trades
+        while True:
+            answer = next(answers, None)
+            if answer is None:
+                return False
+            order = validation.parse_order(answer)
+            if order is None or (order[0] == 'Next' and not game.STAGED_REVEALS):
+                result.invalid += 1
+                continue
+
+            action, units = order
+            if action == 'Pass':
+                round.place_order('Pass', 0)
+                break
+            if action == 'Next':
+                if round.face_down_count() > 1:
+                    round.reveal_next_card()
+                    round.calculate_ev()
+                    round.calculate_spread()
+                continue
+            if round.place_order(action, units):
+                break
+            result.rejected += 1
+
+        round.reveal_all_cards()
+
+        # Player reports P/L
+        if round.order != 'Pass':
+            while True:
+                answer = next(answers, None)
+                if answer is None:
+                    return False
+                pl = validation.parse_pl(answer)
+                if pl is not None:
+                    round.player_input_pl = pl
+                    break
+                result.invalid += 1
+
+        round.calculate_pl()
+        player.balance += round.player_true_pl
+        round.player_end_bal = player.balance
+        if recorder:
+            recorder.record(round, session, deck)
+        round.clear_cards()
+        result.rounds += 1
+        curr_round += 1
+    return True
+
+
+def play_script(lines: Iterable[str], seed: int = 0, games: int = None,
+                spec: DeckSpec = None, recorder: RoundRecorder = None,
+                deck: int = 0) -> BatchResult:
+    """
+    Plays games until the script or the number of games runs out.
+    :param lines:    Lines of the script e.g. an open file or sys.stdin
+    :param seed:     Root seed of the games
+    :param games:    Max number of games, no limit if None
+    :param spec:     The compiled deck, game.DECK if None
+    :param recorder: Round log each finished round is written to
+    :param deck:     Deck written to the round log
+    :return:         The totals of the batch
+    """
+    spec = spec if spec is not None else game.get_deck_spec(game.DECK)
+    answers = read_answers(lines)
+    root = RandomStream(seed)
+    result = BatchResult()
+    result.first_session = new_session_id()
+    start = time.perf_counter()
+    while games is None or result.games < games:
+        # A game is only started if the script has an answer left for it
+        first = next(answers, None)
+        if first is None:
+            break
+        result.games += 1
+        if not play_game(chain((first,), answers), spec, root.spawn('game', result.games),
+                         result, recorder, result.first_session + result.games - 1, deck):
+            break
+        result.finished += 1
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Play scripted games without a console')
+    parser.add_argument('script', help='script of answers, - for stdin, or a round log '
+                                       'with --from-log')
+    parser.add_argument('--from-log', action='store_true',
+                        help='replay the orders and P/L reports of a round log')
+    parser.add_argument('--session', type=int, default=None,
+                        help='only replay this session of the round log')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--games', type=int, default=None,
+                        help='max number of games, until the script runs out by default')
+    parser.add_argument('--output', default=BATCH_LOG, help='round log of the results')
+    parser.add_argument('--format', default='jsonl', choices=['jsonl', 'bin'])
+    parser.add_argument('--deck', type=int, default=game.DECK, choices=sorted(game.RANKS))
+    parser.add_argument('--deck-config', default=None,
+                        help='JSON or TOML deck configuration file, instead of --deck')
+    args = parser.parse_args()
+
+    spec = game.get_deck_spec(args.deck_config if args.deck_config else args.deck)
+    deck = 0 if args.deck_config else args.deck
+    # Records are left to the file buffer and flushed when the log is closed
+    with RoundRecorder(args.output, args.format, game.CARDS_PER_ROUND, flush=False) as recorder:
+        if args.from_log:
+            result = play_script(script_from_log(args.script, args.session), args.seed,
+                                 args.games, spec, recorder, deck)
+        elif args.script == '-':
+            result = play_script(sys.stdin, args.seed, args.games, spec, recorder, deck)
+        else:
+            with open(args.script, encoding='utf-8') as file:
+                result = play_script(file, args.seed, args.games, spec, recorder, deck)
+
+    print(f'Games:       {result.finished} finished of {result.games}')
+    print(f'Rounds:      {result.rounds}')
+    print(f'Invalid:     {result.invalid}')
+    print(f'Rejected:    {result.rejected}')
+    if result.games:
+        print(f'Sessions:    game n is session {result.first_session} + n - 1')
+    print(f'Elapsed:     {result.elapsed:.3f}s')
+    print(f'Games/sec:   {result.games_per_second():,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,467 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The benchmark module measures the performance of the market making card 
+game and fails if it regresses past a budget.
+
+Usage:
+    python benchmark.py startup                 Import time of the game modules
+    python benchmark.py lifecycle               Time and peak memory of each
+                                                phase of a round
+    python benchmark.py compare OLD NEW         Phases of NEW slower than OLD
+    python benchmark.py memory                  Bytes per round of a round 
+                                                history
+    python benchmark.py orderbook               Orders matched per second 
+                                                with thousands of resting 
+                                                orders
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from itertools import permutations
+
+# Budget of the cumulative import time of each module in microseconds
+IMPORT_BUDGETS = {'game': 100_000, 'round': 60_000}
+
+# Modules which must only be loaded by the features which need them
+LAZY_MODULES = ('numpy', 'matplotlib')
+
+
+def import_time(module: str, repeat: int = 5) -> int:
+    """
+    Measures the cumulative import time of a module in a new interpreter
+    with python -X importtime.
+    :param module: The module name
+    :param repeat: The number of runs, the fastest run is returned
+    :return:       The import time in microseconds
+    """
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                capture_output=True, text=True, check=True)
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].rstrip() == f' {module}':
+                cumulative = int(fields[1])
+                best = cumulative if best is None else min(best, cumulative)
+    return best
+
+
+def loaded_modules(module: str, names=LAZY_MODULES) -> list[str]:
+    """
+    Lists which of the named modules are loaded by importing a module.
+    """
+    code = (f'import sys, {module}; '
+            f'print(" ".join(name for name in {list(names)} if name in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def check_startup(budgets: dict[str, int] = IMPORT_BUDGETS) -> bool:
+    """
+    Checks the import time of each module against its budget.
+    :return: True if every module is within budget
+    """
+    passed = True
+    for module, budget in budgets.items():
+        elapsed = import_time(module)
+        loaded = loaded_modules(module)
+        ok = elapsed <= budget and not loaded
+        passed &= ok
+        print(f'{module:<10} {elapsed / 1000:>8.1f} ms (budget {budget / 1000:.1f} ms)',
+              f'loads {", ".join(loaded)}' if loaded else '',
+              'OK' if ok else 'FAIL')
+    return passed
+
+
+# Phases of the round lifecycle
+PHASES = ('shuffle', 'calculate_ev', 'calculate_max_value',
+          'calculate_value_distribution', 'calculate_spread', 'quote_spread', 'check_risk',
+          'calculate_pl')
+
+# Order sizes checked at once by the check_risk phase
+RISK_UNITS = range(1, 101)
+
+LIFECYCLE_DECKS = (1, 2, 3)
+LIFECYCLE_CARDS = (3, 6, 10)
+LIFECYCLE_OUTPUT = 'bench_results.json'
+
+# Order book throughput: resting orders kept in the book, incoming orders
+# timed and players trading
+BOOK_RESTING = 5_000
+BOOK_ORDERS = 100_000
+BOOK_TRADERS = 100
+
+# Largest number of permutations the reference value distribution enumerates
+MAX_REFERENCE_PERMUTATIONS = 200_000
+
+
+def time_phase(func, repeat: int) -> dict:
+    """
+    Measures the time and peak memory of a phase.
+    :param func:   Callable running the phase once
+    :param repeat: The number of timed runs
+    :return:       Dictionary of mean and min time in microseconds and peak
+                   memory in bytes
+    """
+    # Warm up e.g. lazy imports and caches
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    # Memory is traced on a separate run as tracing slows the phase down
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'mean_us': sum(times) / len(times) * 1e6,
+            'min_us': min(times) * 1e6,
+            'peak_bytes': peak}
+
+
+def make_round(deck: int, cards_per_round: int, face_up: int, seen: int = 0):
+    """
+    Creates a round as game.main does with a number of face-up cards.
+    :param deck:            The deck configuration, key of game.RANKS
+    :param cards_per_round: The number of cards in the round
+    :param face_up:         The number of face-up cards
+    :param seen:            The number of cards seen in earlier rounds
+    :return:                Tuple (round, game deck)
+    """
+    import game
+    from deck import Deck
+    from knowledge import KnowledgeState
+    from round import Round
+
+    spec = game.get_deck_spec(deck)
+    game_deck = Deck(spec=spec)
+    game_deck.shuffle()
+    knowledge = KnowledgeState(spec, spec.card_values)
+    seen_cards = set()
+    for card_id in game_deck.deal_ids(seen):
+        seen_cards.add(card_id)
+        knowledge.reveal(card_id)
+
+    round = Round(const_deck=spec, picked_cards=game_deck.deal(cards_per_round),
+                  is_face_up=[idx < face_up for idx in range(cards_per_round)],
+                  card_values=spec.card_values, seen_cards=seen_cards, knowledge=knowledge)
+    round.show_round()
+    return round, game_deck
+
+
+def reference_ev(round) -> float:
+    """
+    EV from a scan of every card in the deck against the seen cards.
+    """
+    unseen = [round.card_values[card.rank] for card in round.const_deck.deck
+              if card.card_id not in round.seen_cards]
+    ev_unseen = sum(unseen) / len(unseen)
+    return sum(round.card_values[card.rank] if is_face_up else ev_unseen
+               for card, is_face_up in zip(round.picked_cards, round.is_face_up))
+
+
+def reference_max_value(round) -> int:
+    """
+    Max value from sorting every unseen card by value.
+    """
+    unseen = sorted((round.card_values[card.rank] for card in round.const_deck.deck
+                     if card.card_id not in round.seen_cards), reverse=True)
+    face_up = [round.card_values[card.rank]
+               for card, is_face_up in zip(round.picked_cards, round.is_face_up) if is_face_up]
+    return sum(face_up) + sum(unseen[:len(round.picked_cards) - len(face_up)])
+
+
+def reference_value_distribution(round) -> dict[int, float]:
+    """
+    Value distribution from enumerating permutations of the unseen cards.
+    :return: Mapping of total value to probability or None if there are too
+             many permutations to enumerate
+    """
+    unseen = [card for card in round.const_deck.deck if card.card_id not in round.seen_cards]
+    face_down = round.face_down_count()
+    count = 1
+    for n in range(len(unseen) - face_down + 1, len(unseen) + 1):
+        count *= n
+    if count > MAX_REFERENCE_PERMUTATIONS:
+        return None
+
+    sum_face_up = sum(round.card_values[card.rank]
+                      for card, is_face_up in zip(round.picked_cards, round.is_face_up)
+                      if is_face_up)
+    frequency = Counter(sum(round.card_values[card.rank] for card in perm) + sum_face_up
+                        for perm in permutations(unseen, face_down))
+    return {value: freq / count for value, freq in frequency.items()}
+
+
+def check_reference(round) -> list[str]:
+    """
+    Checks the round calculations against the reference implementations.
+    :return: List of the phases which do not match
+    """
+    mismatches = []
+    if abs(round.calculate_ev() - reference_ev(round)) > 1e-9:
+        mismatches.append('calculate_ev')
+    if round.calculate_max_value() != reference_max_value(round):
+        mismatches.append('calculate_max_value')
+
+    expected = reference_value_distribution(round)
+    if expected is not None:
+        probs = round.calculate_value_distribution(chart=False)
+        values = set(expected) | {value for value, prob in enumerate(probs) if prob > 0}
+        if any(abs((probs[value] if value < len(probs) else 0) - expected.get(value, 0)) > 1e-9
+               for value in values):
+            mismatches.append('calculate_value_distribution')
+    return mismatches
+
+
+def benchmark_round(deck: int, cards_per_round: int, face_up: int, repeat: int) -> dict:
+    """
+    Measures each phase of a round.
+    :return: Dictionary of the configuration, phases and reference mismatches
+    """
+    round, game_deck = make_round(deck, cards_per_round, face_up)
+    round.calculate_ev()
+    round.calculate_spread()
+    round.player_start_bal = 500
+    round.order, round.order_unit = 'Buy', 1
+
+    def calculate_max_value():
+        round.value_index = None
+        round.calculate_max_value()
+
+    phases = {'shuffle': game_deck.shuffle,
+              'calculate_ev': round.calculate_ev,
+              'calculate_max_value': calculate_max_value,
+              'calculate_value_distribution':
+                  lambda: round.calculate_value_distribution(chart=False),
+              'calculate_spread': round.calculate_spread,
+              'quote_spread': round.quote_spread,
+              'check_risk': lambda: round.check_risk('Sell', RISK_UNITS),
+              'calculate_pl': round.calculate_pl}
+    return {'deck': deck,
+            'cards_per_round': cards_per_round,
+            'face_up': face_up,
+            'deck_size': len(round.const_deck),
+            'phases': {name: time_phase(phases[name], repeat) for name in PHASES},
+            'mismatches': check_reference(round)}
+
+
+def run_lifecycle(decks=LIFECYCLE_DECKS, cards=LIFECYCLE_CARDS, repeat: int = 50) -> dict:
+    """
+    Measures each phase of a round for every deck configuration, number of
+    cards per round and number of face-up cards.
+    :return: Dictionary of results which can be written as JSON
+    """
+    results = []
+    for deck in decks:
+        for cards_per_round in cards:
+            for face_up in range(cards_per_round // 3 + 1):
+                result = benchmark_round(deck, cards_per_round, face_up, repeat)
+                results.append(result)
+                print(f'deck {deck} cards {cards_per_round:>2} face-up {face_up}',
+                      ' '.join(f'{name}={phase["mean_us"]:.0f}us'
+                               for name, phase in result['phases'].items()),
+                      f'MISMATCH {", ".join(result["mismatches"])}' if result['mismatches'] else '')
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': repeat,
+            'results': results}
+
+
+def measure_round_memory(rounds: int = 10_000, deck: int = 1,
+                         cards_per_round: int = None) -> dict:
+    """
+    Measures the memory of a history of finished rounds. Rounds are played
+    as in game.main, starting a new game whenever the deck runs out, and a
+    snapshot of each finished round is kept.
+    :param rounds:          The number of rounds in the history
+    :param deck:            Key of game.RANKS
+    :param cards_per_round: The number of cards per round, 
+                            game.CARDS_PER_ROUND if None
+    :return:                Dictionary of bytes per round
+    """
+    import game
+    from deck import Deck
+    from knowledge import KnowledgeState
+    from streams import RandomStream
+
+    spec = game.get_deck_spec(deck)
+    cards_per_round = cards_per_round or game.CARDS_PER_ROUND
+    rng = RandomStream(0)
+    history = []
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    game_deck = None
+    for round_num in range(rounds):
+        if game_deck is None or len(game_deck) < cards_per_round:
+            game_deck = Deck(rng=rng, spec=spec)
+            game_deck.shuffle()
+            knowledge = KnowledgeState(spec, spec.card_values)
+            seen_cards = set()
+        round = game.deal_round(round_num + 1, game_deck, spec, knowledge, seen_cards, rng=rng)
+        round.show_round()
+        round.calculate_ev()
+        round.calculate_spread()
+        round.place_order('Pass', 0)
+        round.reveal_all_cards()
+        round.calculate_pl()
+        history.append(round.snapshot())
+    history_bytes = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return {'rounds': rounds,
+            'cards_per_round': cards_per_round,
+            'bytes_per_round': history_bytes / rounds}
+
+
+def measure_order_book(resting: int = BOOK_RESTING, orders: int = BOOK_ORDERS,
+                       traders: int = BOOK_TRADERS, seed: int = 0) -> dict:
+    """
+    Measures the matching throughput of the order book. The book is filled
+    with resting orders of the players either side of the EV, then each 
+    incoming order crosses up to a few price levels past the best price and
+    is followed by resting orders which top the book back up to the 
+    resting size. Incoming orders are immediate or cancel, so what they do 
+    not fill is cancelled rather than rested and the depth stays at the 
+    resting size. The market maker does not quote, as its unlimited quote 
+    would fill every incoming order at the best price.
+    :param resting: The number of resting orders
+    :param orders:  The number of incoming orders timed
+    :param traders: The number of players
+    :param seed:    Seed of the prices, sides and sizes
+    :return:        Dictionary of the depth at the start, end and largest,
+                    orders submitted, incoming orders matched and fills per
+                    second
+    """
+    from order_book import Market
+    from streams import RandomStream
+
+    round, _ = make_round(1, 3, 1)
+    mid = int(round.calculate_ev())
+    market = Market(round)
+    names = [f'player{idx}' for idx in range(traders)]
+    for name in names:
+        market.join(name, 1 << 40)
+    book = market.book
+    rng = RandomStream(seed, 'orderbook')
+
+    def rest():
+        offset = rng.randint(1, 20)
+        if rng.random() < 0.5:
+            market.submit(rng.choice(names), 'Buy', rng.randint(1, 10), mid - offset)
+        else:
+            market.submit(rng.choice(names), 'Sell', rng.randint(1, 10), mid + offset)
+
+    for _ in range(resting):
+        rest()
+    # Incoming orders are drawn before timing so mostly matching is measured
+    incoming = [(rng.choice(names), rng.random() < 0.5, rng.randint(1, 10), rng.randint(0, 3))
+                for _ in range(orders)]
+    trades = len(book.trades)
+    start_resting = max_resting = len(book)
+    submitted = matched = 0
+    start = time.perf_counter()
+    for name, is_buy, units, levels in incoming:
+        if is_buy:
+            order = market.submit(name, 'Buy', units, (book.best_ask() or mid) + levels)
+        else:
+            order = market.submit(name, 'Sell', units, (book.best_bid() or mid) - levels)
+        matched += order.filled() > 0
+        book.cancel(order)
+        while len(book) < resting:
+            rest()
+            submitted += 1
+        max_resting = max(max_resting, len(book))
+    elapsed = time.perf_counter() - start
+    fills = len(book.trades) - trades
+    return {'start_resting': start_resting,
+            'resting': len(book),
+            'max_resting': max_resting,
+            'orders': orders,
+            'matched': matched,
+            'fills': fills,
+            'orders_per_second': (orders + submitted) / elapsed,
+            'matched_per_second': matched / elapsed,
+            'fills_per_second': fills / elapsed}
+
+
+def result_key(result: dict) -> tuple:
+    return result['deck'], result['cards_per_round'], result['face_up']
+
+
+def compare(old: dict, new: dict, tolerance: float = 1.25) -> list[str]:
+    """
+    Compares two lifecycle runs.
+    :param tolerance: Ratio of new to old min time treated as a regression
+    :return:          List of regressions
+    """
+    old_results = {result_key(result): result for result in old['results']}
+    regressions = []
+    for result in new['results']:
+        key = result_key(result)
+        if key not in old_results:
+            continue
+        for name, phase in result['phases'].items():
+            old_phase = old_results[key]['phases'].get(name)
+            if old_phase and phase['min_us'] > old_phase['min_us'] * tolerance:
+                regressions.append(f'deck {key[0]} cards {key[1]} face-up {key[2]} {name}: '
+                                   f'{old_phase["min_us"]:.1f}us -> {phase["min_us"]:.1f}us')
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the market making card game')
+    parser.add_argument('benchmark', choices=['startup', 'lifecycle', 'compare', 'memory',
+                                                    'orderbook'])
+    parser.add_argument('files', nargs='*', help='OLD and NEW results to compare')
+    parser.add_argument('--output', default=LIFECYCLE_OUTPUT)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    if args.benchmark == 'startup':
+        passed = check_startup()
+    elif args.benchmark == 'lifecycle':
+        results = run_lifecycle(repeat=args.repeat)
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        passed = not any(result['mismatches'] for result in results['results'])
+    elif args.benchmark == 'memory':
+        for cards_per_round in LIFECYCLE_CARDS:
+            result = measure_round_memory(cards_per_round=cards_per_round)
+            print(f'cards {cards_per_round:>2} {result["bytes_per_round"]:>8.0f} bytes per round')
+        passed = True
+    elif args.benchmark == 'orderbook':
+        result = measure_order_book()
+        print(f'{result["orders"]:,} incoming orders, {result["start_resting"]:,} resting '
+              f'before, {result["resting"]:,} after, {result["max_resting"]:,} at most: '
+              f'{result["matched"]:,} matched, {result["fills"]:,} fills')
+        print(f'{result["matched_per_second"]:,.0f} matched/sec '
+              f'{result["fills_per_second"]:,.0f} fills/sec '
+              f'{result["orders_per_second"]:,.0f} orders submitted/sec')
+        passed = True
+    else:
+        if len(args.files) != 2:
+            parser.error('compare needs OLD and NEW results')
+        with open(args.files[0], encoding='utf-8') as old, \
+                open(args.files[1], encoding='utf-8') as new:
+            regressions = compare(json.load(old), json.load(new), args.tolerance)
+        for regression in regressions:
+            print(regression)
+        passed = not regressions
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
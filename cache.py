@@ -0,0 +1,112 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The cache module memoizes round calculations by the canonical knowledge
+state of a round. Rounds with the same deck, the same unseen card values,
+the same face-up sum and the same number of face-down cards have the same
+EV, max value and value distribution, whichever cards were actually seen.
+Building the key costs more than the O(1) EV and max value of a knowledge
+state, so rounds only cache those with a market event or without knowledge.
+"""
+import threading
+from collections import OrderedDict
+
+MAXSIZE = 4096
+
+"""
+Class to represent a bounded least recently used cache with hit and miss
+statistics.
+"""
+class StateCache:
+    def __init__(self, maxsize: int = MAXSIZE) -> None:
+        """
+        :param maxsize: Max number of entries, the least recently used entry
+                        is evicted once it is reached
+        """
+        self.maxsize: int = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value) -> None:
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_calculate(self, key, calculate):
+        """
+        Returns the cached value of a key, calculating and caching it on a miss.
+        :param key:       The canonical state key
+        :param calculate: Callable returning the value
+        :return:          The value
+        """
+        value = self.get(key, self)
+        if value is self:
+            value = calculate()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def stats(self) -> dict:
+        return {'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hit_rate()}
+
+
+# Cache shared by every session in the process
+shared_cache = StateCache()
+
+
+def value_signature(value_counts: dict[int, int]) -> tuple[tuple[int, int], ...]:
+    """
+    Creates the canonical signature of a multiset of card values.
+    :param value_counts: Mapping of value to number of cards
+    :return:             Tuple of (value, count) sorted by value
+    """
+    return tuple(sorted((value, count) for value, count in value_counts.items() if count > 0))
+
+
+def state_key(deck_signature: tuple, unseen_counts: dict[int, int], face_up_sum: int,
+              face_down: int) -> tuple:
+    """
+    Creates the canonical key of a round knowledge state.
+    :param deck_signature: value_signature of the full deck
+    :param unseen_counts:  Mapping of value to number of unseen cards
+    :param face_up_sum:    The total value of the face-up cards
+    :param face_down:      The number of face-down cards
+    :return:               Hashable key
+    """
+    return deck_signature, value_signature(unseen_counts), face_up_sum, face_down
@@ -0,0 +1,189 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The charts module renders value distribution histograms away from the game
+loop. Charts are rendered by a background worker thread or process pool
+from plain probability arrays, and each worker reuses one figure. Each 
+chart is written to a temporary file which then replaces the chart, so a
+chart is never left half written or interleaved with another worker's.
+"""
+import os
+import threading
+from concurrent import futures
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+CHART_DIR = f'{DIR_PATH}/charts'
+
+FORMATS = ('png', 'npz')
+
+# One figure per worker thread or process which is cleared and reused
+_worker = threading.local()
+
+
+def chart_path(round_num: int, fmt: str = 'png', directory: str = CHART_DIR) -> str:
+    return f'{directory}/round_{round_num}_histogram.{fmt}'
+
+
+def temp_path(path: str) -> str:
+    """
+    Returns a temporary file path next to a chart which is unique to the 
+    worker writing it.
+    """
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def save_chart(path: str, round_num: int, probs) -> None:
+    """
+    Plots the probability of each total value and saves the chart.
+    :param path:      The file path
+    :param round_num: The round number
+    :param probs:     Array where index is the total value and element is
+                      the probability of that total
+    """
+    import numpy as np
+
+    fig = getattr(_worker, 'fig', None)
+    if fig is None:
+        # Figures are not created through pyplot so they are not retained
+        # by it and do not need a GUI backend.
+        from matplotlib.figure import Figure
+        fig = _worker.fig = Figure()
+    fig.clear()
+
+    values = np.nonzero(probs)[0]
+    ax = fig.subplots()
+    ax.bar(values, probs[values], width=1.0)
+    ax.set_xlabel('Value')
+    ax.set_xlim(xmin=0, xmax=50)
+    ax.set_ylabel('Probability Density')
+    ax.set_ylim(ymax=0.1)
+    ax.set_title(f'Card Value Sum Probability Density - Round {round_num}')
+    fig.tight_layout()
+    try:
+        temp = temp_path(path)
+        with open(temp, 'wb') as file:
+            fig.savefig(file, format='png', bbox_inches="tight")
+        os.replace(temp, path)
+    except FileNotFoundError:
+        pass
+
+
+def save_data(path: str, round_num: int, probs) -> None:
+    """
+    Saves the probability of each total value as raw histogram data.
+    """
+    import numpy as np
+
+    try:
+        temp = temp_path(path)
+        with open(temp, 'wb') as file:
+            np.savez(file, round_num=round_num, probs=probs)
+        os.replace(temp, path)
+    except FileNotFoundError:
+        pass
+
+
+def render(charts: list[tuple[str, int, object]], fmt: str = 'png') -> None:
+    """
+    Saves a list of charts in one task.
+    :param charts: List of (path, round number, probabilities)
+    :param fmt:    'png' for a chart or 'npz' for raw histogram data
+    """
+    save = save_chart if fmt == 'png' else save_data
+    for path, round_num, probs in charts:
+        save(path, round_num, probs)
+
+
+"""
+Class to represent a background chart rendering stage.
+"""
+class ChartRenderer:
+    def __init__(self, directory: str = CHART_DIR, fmt: str = 'png',
+                 batch: bool = False, processes: int = 0) -> None:
+        """
+        :param directory: The directory charts are saved to
+        :param fmt:       'png' for charts or 'npz' for raw histogram data
+        :param batch:     Hold every chart until close (True) or render each
+                          chart as it is submitted (False)
+        :param processes: The number of worker processes, 0 for one worker
+                          thread
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f'Chart format must be one of {", ".join(FORMATS)}')
+        self.directory: str = directory
+        self.fmt: str = fmt
+        self.batch: bool = batch
+
+        # The latest chart of each path, so a chart replaced before it is
+        # rendered is dropped
+        self.pending: dict[str, tuple[str, int, object]] = {}
+        self.futures: dict[str, futures.Future] = {}
+        # The latest chart of each path still being rendered, started by the
+        # next submit or flush after the render finishes, so it is never 
+        # replaced by the older chart
+        self.waiting: dict[str, tuple[str, int, object]] = {}
+        # The executor classes are looked up here because importing them
+        # loads multiprocessing
+        self.executor: futures.Executor = (futures.ProcessPoolExecutor(processes) 
+                                           if processes > 0 
+                                           else futures.ThreadPoolExecutor(1))
+
+    def __enter__(self) -> 'ChartRenderer':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(self, round_num: int, probs) -> None:
+        """
+        Queues the chart of a round without waiting for it to be rendered.
+        :param round_num: The round number
+        :param probs:     Array of the probability of each total value
+        """
+        path = chart_path(round_num, self.fmt, self.directory)
+        chart = (path, round_num, probs)
+        if self.batch:
+            self.pending[path] = chart
+            return
+
+        # A chart of the same path e.g. before a requote is cancelled if it 
+        # has not started, or else this chart waits for it without blocking
+        self.collect()
+        previous = self.futures.get(path)
+        if previous is not None and not previous.cancel():
+            self.waiting[path] = chart
+        else:
+            self.futures[path] = self.executor.submit(render, [chart], self.fmt)
+
+    def collect(self) -> None:
+        """
+        Drops finished charts, raising any rendering error, and starts the 
+        waiting chart of each path which has finished.
+        """
+        for path, future in [item for item in self.futures.items() if item[1].done()]:
+            del self.futures[path]
+            if not future.cancelled():
+                future.result()
+            chart = self.waiting.pop(path, None)
+            if chart is not None:
+                self.futures[path] = self.executor.submit(render, [chart], self.fmt)
+
+    def flush(self) -> None:
+        """
+        Renders any held charts and waits for every chart to be saved.
+        """
+        pending = []
+        if self.pending:
+            pending.append(self.executor.submit(render, list(self.pending.values()),
+                                                self.fmt))
+            self.pending = {}
+        while self.futures:
+            futures.wait(list(self.futures.values()))
+            self.collect()
+        for future in pending:
+            future.result()
+
+    def close(self) -> None:
+        self.flush()
+        self.executor.shutdown()
@@ -4,9 +4,26 @@ Date: 05/04/24
 
 The deck module contains methods for cards and decks for the 
 market making card game.
-"""
 
-from collections import deque
+A DeckSpec is the immutable compiled form of a deck configuration. It is
+built once per configuration and shared by every round and session, and can
+be loaded from a JSON or TOML file e.g.
+
+    {"name": "Standard",
+     "ranks": ["2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A"],
+     "suits": ["♥", "♦", "♣", "♠"],
+     "face_card_values": {"J": 11, "Q": 12, "K": 13, "A": 14}}
+
+Numeric ranks are worth their number unless given in card_values, which 
+maps any rank to its value.
+
+A Shoe holds several copies of a deck as the number of copies left of each
+card, so dealing from it scales with the number of distinct cards rather
+than the number of physical cards.
+"""
+import json
+import os
+from types import MappingProxyType
 
 import random as rand
 
@@ -14,6 +31,8 @@ import random as rand
 Class to represent a playing card.
 """
 class Card:
+    __slots__ = ('card_id', 'rank', 'suit')
+
     def __init__(self, card_id=0, rank=0, suit=None) -> None:
         """
         :param card_id: The card ID number
@@ -29,24 +48,182 @@ class Card:
 
 
 """
-Class to represent a deck of cards.
+Class to represent the immutable compiled specification of a deck. It 
+provides the read-only part of the Deck interface so it can be used as the
+full deck of a round.
+"""
+class DeckSpec:
+    __slots__ = ('name', 'ranks', 'suits', 'card_values', 'cards', 'values',
+                 'values_sorted', 'histogram', 'total', 'signature')
+
+    def __init__(self, ranks, suits, card_values: dict[str, int], name: str = '') -> None:
+        """
+        :param ranks:         The ranks
+        :param suits:         The suits
+        :param card_values:   Mapping of rank to value
+        :param name:          The deck name
+        :param cards:         Table of every card in the deck indexed by card ID
+        :param values:        The value of each card indexed by card ID
+        :param values_sorted: The value of every card sorted from lowest
+        :param histogram:     Mapping of value to number of cards
+        :param total:         The total value of the deck
+        :param signature:     Tuple of (value, count) sorted by value
+        """
+        if not ranks or not suits:
+            raise ValueError('A deck needs at least one rank and one suit')
+        missing = [rank for rank in ranks if rank not in card_values]
+        if missing:
+            raise ValueError(f'No value for ranks {", ".join(missing)}')
+
+        cards = tuple(Card(rank_idx * len(suits) + suit_idx, rank, suit)
+                      for rank_idx, rank in enumerate(ranks)
+                      for suit_idx, suit in enumerate(suits))
+        values = tuple(card_values[card.rank] for card in cards)
+        histogram = {}
+        for value in values:
+            histogram[value] = histogram.get(value, 0) + 1
+
+        init = super().__setattr__
+        init('name', name)
+        init('ranks', tuple(ranks))
+        init('suits', tuple(suits))
+        init('card_values', MappingProxyType({rank: card_values[rank] for rank in ranks}))
+        init('cards', cards)
+        init('values', values)
+        init('values_sorted', tuple(sorted(values)))
+        init('histogram', MappingProxyType(dict(sorted(histogram.items()))))
+        init('total', sum(values))
+        init('signature', tuple(self.histogram.items()))
+
+    def __setattr__(self, name, value) -> None:
+        raise AttributeError('DeckSpec is immutable')
+
+    def __copy__(self) -> 'DeckSpec':
+        return self
+
+    def __deepcopy__(self, memo) -> 'DeckSpec':
+        return self
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def __str__(self) -> str:
+        return ', '.join([str(card) for card in self.cards])
+
+    def __repr__(self) -> str:
+        return f'DeckSpec({self.name!r}, {len(self.ranks)} ranks, {len(self.suits)} suits)'
+
+    @property
+    def deck(self) -> tuple[Card, ...]:
+        """
+        Every card in the deck in card ID order.
+        """
+        return self.cards
+
+    def is_deck_values(self, card_values) -> bool:
+        return (card_values is None or card_values is self.card_values
+                or card_values == self.card_values)
+
+    def value_table(self, card_values=None) -> tuple[int, ...]:
+        """
+        Returns the value of each card indexed by card ID.
+        :param card_values: Mapping of rank to value, the deck values if None
+        """
+        if self.is_deck_values(card_values):
+            return self.values
+        return tuple(card_values[card.rank] for card in self.cards)
+
+    def value_counts(self, card_values=None) -> dict[int, int]:
+        """
+        Counts how many cards there are of each value.
+        :param card_values: Mapping of rank to value, the deck values if None
+        :return:            Mapping of value to number of cards
+        """
+        if self.is_deck_values(card_values):
+            return dict(self.histogram)
+        counts = {}
+        for value in self.value_table(card_values):
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    @classmethod
+    def from_config(cls, config: dict, name: str = '') -> 'DeckSpec':
+        """
+        Compiles a deck configuration.
+        :param config: Mapping with ranks, suits and optionally name,
+                       face_card_values and card_values
+        :return:       The compiled deck
+        """
+        for key in ('ranks', 'suits'):
+            if key not in config:
+                raise ValueError(f'Deck configuration is missing {key}')
+        ranks = [str(rank) for rank in config['ranks']]
+        card_values = {rank: int(rank) for rank in ranks if rank.isnumeric()}
+        card_values.update(config.get('face_card_values', {}))
+        card_values.update(config.get('card_values', {}))
+        return cls(ranks, [str(suit) for suit in config['suits']], card_values,
+                   config.get('name', name))
+
+
+# Compiled decks loaded from files by path and modified time
+_loaded_specs: dict[tuple[str, float], DeckSpec] = {}
+
+
+def load_deck_spec(path: str) -> DeckSpec:
+    """
+    Loads and compiles a deck configuration file, or returns the deck 
+    already compiled from it.
+    :param path: Path of a .json or .toml file
+    :return:     The compiled deck
+    """
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    spec = _loaded_specs.get(key)
+    if spec is None:
+        if path.endswith('.toml'):
+            import tomllib
+
+            with open(path, 'rb') as file:
+                config = tomllib.load(file)
+        else:
+            with open(path, encoding='utf-8') as file:
+                config = json.load(file)
+        name = os.path.splitext(os.path.basename(path))[0]
+        spec = _loaded_specs[key] = DeckSpec.from_config(config, name)
+    return spec
+
+
+"""
+Class to represent a deck of cards. Cards are stored as integer card IDs 
+which index a table of Card objects created once per deck.
 """
 class Deck:
-    def __init__(self, ranks=None, suits=None) -> None:
+    def __init__(self, ranks=None, suits=None, rng=None, spec=None) -> None:
         """
-        :param suits:  The list of suits
-        :param values: The list of values
-        :param deck:   Double ended queue of cards
+        :param suits:    The list of suits
+        :param values:   The list of values
+        :param rng:      Random number generator e.g. a streams.RandomStream, 
+                         the global random module if None
+        :param spec:     Compiled deck whose card table is reused instead of 
+                         creating the cards from ranks and suits
+        :param cards:    Table of every card in the deck indexed by card ID
+        :param card_ids: List of card IDs in the deck, top of the deck last
         """
+        if spec is not None:
+            ranks, suits = list(spec.ranks), list(spec.suits)
         if suits is None:
             suits = []
         if ranks is None:
             ranks = []
         self.ranks: list[str] = ranks
         self.suits: list[str] = suits
+        self.rng: rand.Random = rng if rng is not None else rand
 
-        self.deck: deque = deque()
-        if len(self.deck) == 0:
+        self.cards: tuple[Card, ...] = ()
+        self.card_ids: list[int] = []
+        if spec is not None:
+            self.cards = spec.cards
+            self.card_ids = list(range(len(spec.cards)))
+        if len(self.card_ids) == 0:
             self.create_deck(self.ranks, self.suits)
 
     def __str__(self) -> str:
@@ -54,6 +231,22 @@ class Deck:
     
     def __repr__(self) -> str:
         return str(self.deck)
+
+    def __len__(self) -> int:
+        return len(self.card_ids)
+
+    @property
+    def deck(self) -> tuple[Card, ...]:
+        """
+        Tuple of the cards in the deck, top of the deck last. The deck is 
+        stored as card IDs, so the tuple is read-only and cards are dealt 
+        with deal or deal_ids.
+        """
+        return tuple(self.cards[card_id] for card_id in self.card_ids)
+
+    @deck.setter
+    def deck(self, cards) -> None:
+        self.card_ids = [card.card_id for card in cards]
     
     def create_deck(self, ranks: list[str], suits: list[str]) -> None:
         """
@@ -69,31 +262,202 @@ class Deck:
                 for suit in suits:
                     new_deck.append(Card(card_id, rank, suit))
                     card_id += 1
-            self.deck = deque(new_deck)
+            self.cards = tuple(new_deck)
+            self.card_ids = list(range(len(new_deck)))
         else:
             print("Cannot create deck!")
 
+    def value_table(self, card_values: dict[str, int]) -> list[int]:
+        """
+        Creates a lookup table of card values.
+        :param card_values: Mapping of rank to value
+        :return:            List where index is the card ID and element is the value
+        """
+        return [card_values[card.rank] for card in self.cards]
+
+    def value_counts(self, card_values: dict[str, int]) -> dict[int, int]:
+        """
+        Counts how many cards in the deck there are of each value.
+        :param card_values: Mapping of rank to value
+        :return:            Mapping of value to number of cards
+        """
+        counts = {}
+        for card_id in self.card_ids:
+            value = card_values[self.cards[card_id].rank]
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
     def shuffle(self) -> None:
         """
         Shuffles deck of cards with Fisher-Yates algorithm
         :param deck:  Representation of a deck as list
         :return:      The shuffled deck as list
         """
-        # Shuffle the deck with Fisher–Yates algorithm
-        if len(self.deck) > 1:
-            for i in range(len(self.deck) - 1):
-                j = rand.randint(i, len(self.deck) - 1)
-                self.deck[i], self.deck[j] = self.deck[j], self.deck[i]
+        # Random.shuffle is the Fisher–Yates algorithm drawing each index 
+        # directly from random bits, without the argument checks of randint
+        self.rng.shuffle(self.card_ids)
+
+    def needs_reshuffle(self) -> bool:
+        """
+        A deck is played through once, it is never reshuffled during a game.
+        """
+        return False
 
     def add_card(self, card: Card) -> None:
         """
         Add the card to the bottom of the deck.
         """
-        self.deck.appendleft(card)
+        self.card_ids.insert(0, card.card_id)
 
     def pick_card(self) -> Card:
         """
         Return and remove the card from the top of the deck.
         :return:     A card from the deck
         """
-        return self.deck.pop() if len(self.deck) > 0 else None
+        return self.cards[self.card_ids.pop()] if len(self.card_ids) > 0 else None
+
+    def deal_ids(self, count: int, allowed: int = None) -> list[int]:
+        """
+        Return and remove card IDs from the top of the deck in the order 
+        they would be picked.
+        :param count:   The number of cards
+        :param allowed: Bitmask of the card IDs which can be dealt, any if 
+                        None. Other cards are skipped and stay in the deck.
+        :return:        List of up to count card IDs
+        """
+        if allowed is not None:
+            dealt = []
+            idx = len(self.card_ids) - 1
+            while idx >= 0 and len(dealt) < count:
+                if allowed >> self.card_ids[idx] & 1:
+                    dealt.append(self.card_ids.pop(idx))
+                idx -= 1
+            return dealt
+
+        count = min(count, len(self.card_ids))
+        if count <= 0:
+            return []
+        dealt = self.card_ids[-count:]
+        del self.card_ids[-count:]
+        dealt.reverse()
+        return dealt
+
+    def deal(self, count: int, allowed: int = None) -> list[Card]:
+        """
+        Return and remove cards from the top of the deck in the order they 
+        would be picked.
+        :param count:   The number of cards
+        :param allowed: Bitmask of the card IDs which can be dealt, any if None
+        :return:        List of up to count cards
+        """
+        return [self.cards[card_id] for card_id in self.deal_ids(count, allowed)]
+
+
+"""
+Class to represent a shoe of several copies of a deck. The cards left are
+stored as the number of copies of each card ID instead of a list of cards,
+and every deal draws a card ID weighted by its copies left, which is the 
+same as dealing from the top of the shuffled physical cards.
+"""
+class Shoe:
+    def __init__(self, spec: DeckSpec, decks: int = 6, rng=None,
+                 penetration: float = 0.75) -> None:
+        """
+        :param spec:        The compiled deck copied into the shoe
+        :param decks:       The number of copies of the deck
+        :param rng:         Random number generator e.g. a 
+                            streams.RandomStream, the global random module 
+                            if None
+        :param penetration: Fraction of the shoe dealt before it needs a 
+                            reshuffle e.g. 0.75 reshuffles with a quarter left
+        :param cards:       Table of every card in the deck indexed by card ID
+        :param counts:      List where index is the card ID and element is the
+                            number of copies left
+        :param remaining:   The number of cards left
+        """
+        if decks < 1:
+            raise ValueError('A shoe needs at least one deck')
+        if not 0 < penetration <= 1:
+            raise ValueError('Penetration must be between 0 and 1')
+        self.spec: DeckSpec = spec
+        self.decks: int = decks
+        self.rng: rand.Random = rng if rng is not None else rand
+        self.penetration: float = penetration
+        self.cards: tuple[Card, ...] = spec.cards
+        self.counts: list[int] = []
+        self.remaining: int = 0
+        self.shuffle()
+
+    def __len__(self) -> int:
+        return self.remaining
+
+    def __repr__(self) -> str:
+        return f'Shoe({self.spec.name!r}, {self.decks} decks, {self.remaining} left)'
+
+    def size(self) -> int:
+        return self.decks * len(self.cards)
+
+    def shuffle(self) -> None:
+        """
+        Returns every card to the shoe.
+        """
+        self.counts = [self.decks] * len(self.cards)
+        self.remaining = self.size()
+
+    def needs_reshuffle(self) -> bool:
+        """
+        Checks if the cut card has been reached.
+        """
+        return self.remaining <= self.size() * (1 - self.penetration)
+
+    def value_counts(self, card_values: dict[str, int] = None) -> dict[int, int]:
+        """
+        Counts how many cards in the shoe there are of each value.
+        :param card_values: Mapping of rank to value, the deck values if None
+        :return:            Mapping of value to number of cards
+        """
+        values = self.spec.value_table(card_values)
+        counts = {}
+        for card_id, count in enumerate(self.counts):
+            if count:
+                counts[values[card_id]] = counts.get(values[card_id], 0) + count
+        return counts
+
+    def deal_ids(self, count: int, allowed: int = None) -> list[int]:
+        """
+        Return and remove card IDs from the shoe in the order they are dealt.
+        :param count:   The number of cards
+        :param allowed: Bitmask of the card IDs which can be dealt, any if 
+                        None. Other cards are skipped and stay in the shoe.
+        :return:        List of up to count card IDs
+        """
+        counts = self.counts
+        if allowed is None:
+            total = self.remaining
+        else:
+            total = sum(counts[card_id] for card_id in range(len(counts))
+                        if allowed >> card_id & 1)
+
+        dealt = []
+        while len(dealt) < count and total > 0:
+            pick = self.rng.randrange(total)
+            for card_id, copies in enumerate(counts):
+                if not copies or (allowed is not None and not allowed >> card_id & 1):
+                    continue
+                if pick < copies:
+                    break
+                pick -= copies
+            counts[card_id] -= 1
+            total -= 1
+            self.remaining -= 1
+            dealt.append(card_id)
+        return dealt
+
+    def deal(self, count: int, allowed: int = None) -> list[Card]:
+        """
+        Return and remove cards from the shoe in the order they are dealt.
+        :param count:   The number of cards
+        :param allowed: Bitmask of the card IDs which can be dealt, any if None
+        :return:        List of up to count cards
+        """
+        return [self.cards[card_id] for card_id in self.deal_ids(count, allowed)]
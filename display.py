@@ -37,6 +37,19 @@ def show_card_values(suits: list[str], ranks: list[str],
         print(f'{rank:<2}{"".join(suits)} =', 
               f'{face_card_values[rank] if rank in face_card_values else rank}')
 
+def show_latency(phases: dict[str, dict]):
+    """
+    Prints the mean and max time the player took to decide and the market 
+    maker took to quote, so slow rounds can be put down to one or the other.
+    :param phases: Mapping of phase to timings from Instrumentation.to_dict
+    """
+    labels = {'player_decision': 'Decision time', 'quote': 'Quote time'}
+    for phase, label in labels.items():
+        if phase in phases:
+            stats = phases[phase]
+            print(f'{label + ":":<15}mean {stats["mean_s"] * 1000:.1f}ms, '
+                  f'max {stats["max_s"] * 1000:.1f}ms')
+
 def show_settings(**settings):
     """
     Prints the game settings.
@@ -0,0 +1,217 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The distribution module contains methods for calculating the exact
+distribution of card value sums for the market making card game, and for
+estimating it by Monte Carlo sampling when the exact distribution is too 
+slow to calculate.
+"""
+import time
+from collections import Counter
+from concurrent import futures
+from math import comb, sqrt
+from statistics import NormalDist
+
+import numpy as np
+
+from deck import Card
+
+
+def unseen_value_counts(cards, card_values: dict[str, int],
+                        seen_cards: set[int]) -> dict[int, int]:
+    """
+    Counts how many unseen cards there are of each card value.
+    :param cards:       Iterable of cards in the full deck
+    :param card_values: Mapping of rank to value
+    :param seen_cards:  Set of card IDs which have been seen
+    :return:            Mapping of value to number of unseen cards
+    """
+    counts = Counter()
+    for card in cards:
+        card: Card
+        if card.card_id not in seen_cards:
+            counts[card_values[card.rank]] += 1
+    return dict(counts)
+
+
+def sum_distribution(value_counts: dict[int, int], picks: int,
+                     offset: int = 0) -> np.ndarray:
+    """
+    Calculates the exact probability of each total value when picking cards
+    without replacement. Works on the number of cards of each value so the
+    cost scales with the number of distinct values rather than the number
+    of possible hands.
+    :param value_counts: Mapping of value to number of cards with that value
+    :param picks:        The number of cards picked
+    :param offset:       Value added to every total e.g. sum of face-up cards
+    :return:             Array where index is the total value and element is
+                         the probability of that total
+    """
+    if picks < 0 or picks > sum(value_counts.values()):
+        raise ValueError(f'Cannot pick {picks} cards from '
+                         f'{sum(value_counts.values())} cards')
+
+    max_sum = picks * max(value_counts, default=0)
+    # ways[j, s] is the number of ways to pick j cards which sum to s
+    ways = np.zeros((picks + 1, max_sum + 1))
+    ways[0, 0] = 1
+    for value, count in value_counts.items():
+        new_ways = ways.copy()
+        for taken in range(1, min(count, picks) + 1):
+            shift = taken * value
+            if shift > max_sum:
+                break
+            new_ways[taken:, shift:] += (comb(count, taken)
+                                         * ways[:picks + 1 - taken, :max_sum + 1 - shift])
+        ways = new_ways
+
+    freq = ways[picks]
+    probs = np.zeros(offset + max_sum + 1)
+    probs[offset:] = freq / freq.sum()
+    return probs
+
+
+# Tail quantiles reported by sample_distribution
+QUANTILES = (0.01, 0.05, 0.5, 0.95, 0.99)
+
+# Max number of random keys drawn at once by a sampling task
+MAX_CHUNK_KEYS = 4_000_000
+
+
+"""
+Class to represent a Monte Carlo estimate of the distribution of value sums.
+"""
+class DistributionEstimate:
+    def __init__(self, counts: np.ndarray, offset: int = 0, confidence: float = 0.95,
+                 quantiles=QUANTILES) -> None:
+        """
+        :param counts:     Array where index is the sampled total value and
+                           element is the number of samples with that total
+        :param offset:     Value added to every total e.g. sum of face-up cards
+        :param confidence: Confidence level of the intervals
+        :param quantiles:  The quantiles to estimate
+        """
+        self.samples: int = int(counts.sum())
+        self.probs: np.ndarray = np.zeros(offset + len(counts))
+        self.probs[offset:] = counts / self.samples
+
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        totals = np.arange(len(self.probs))
+        self.ev: float = float((totals * self.probs).sum())
+        self.std: float = float(sqrt(max(((totals - self.ev) ** 2 * self.probs).sum(), 0)))
+        half_width = z * self.std / sqrt(self.samples)
+        self.ev_ci: tuple[float, float] = (self.ev - half_width, self.ev + half_width)
+
+        # Confidence interval of each quantile from the binomial distribution 
+        # of the number of samples below it
+        cdf = np.cumsum(counts)
+        self.quantiles: dict[float, tuple[int, int, int]] = {}
+        for q in quantiles:
+            spread = z * sqrt(self.samples * q * (1 - q))
+            ranks = (self.samples * q, self.samples * q - spread, self.samples * q + spread)
+            low, est, high = (int(np.searchsorted(cdf, min(max(rank, 1), self.samples)))
+                              + offset for rank in sorted(ranks))
+            self.quantiles[q] = (est, low, high)
+
+        self.elapsed: float = 0
+        self.converged: bool = False
+
+    def ev_half_width(self) -> float:
+        return (self.ev_ci[1] - self.ev_ci[0]) / 2
+
+
+def sample_totals(values: np.ndarray, picks: int, samples: int, seed) -> np.ndarray:
+    """
+    Samples the total value of picking cards without replacement.
+    :param values:  Array of the value of each card which can be picked
+    :param picks:   The number of cards picked
+    :param samples: The number of samples
+    :param seed:    Seed for the random number generator
+    :return:        Array where index is the total value and element is the
+                    number of samples with that total
+    """
+    rng = np.random.default_rng(seed)
+    max_sum = picks * int(values.max(initial=0))
+    counts = np.zeros(max_sum + 1, dtype=np.int64)
+    if picks == 0:
+        counts[0] = samples
+        return counts
+
+    # Draw card indices and redraw any sample which picked a card twice. 
+    # When that is unlikely to succeed, pick the cards with the smallest 
+    # random keys instead.
+    accept = 1.0
+    for taken in range(picks):
+        accept *= 1 - taken / len(values)
+    chunk = max(1, MAX_CHUNK_KEYS // (picks if accept > 0.25 else len(values)))
+    for start in range(0, samples, chunk):
+        size = min(chunk, samples - start)
+        if accept > 0.25:
+            picked = rng.integers(0, len(values), size=(size, picks))
+            repeats = np.flatnonzero((np.diff(np.sort(picked, axis=1), axis=1) == 0).any(axis=1))
+            while len(repeats):
+                picked[repeats] = rng.integers(0, len(values), size=(len(repeats), picks))
+                redrawn = np.sort(picked[repeats], axis=1)
+                repeats = repeats[(np.diff(redrawn, axis=1) == 0).any(axis=1)]
+        else:
+            keys = rng.random((size, len(values)))
+            picked = np.argpartition(keys, picks - 1, axis=1)[:, :picks]
+        counts += np.bincount(values[picked].sum(axis=1), minlength=max_sum + 1)
+    return counts
+
+
+def sample_distribution(value_counts: dict[int, int], picks: int, offset: int = 0,
+                        precision: float = 0.05, time_budget: float = 0.5,
+                        batch_size: int = 20_000, max_samples: int = 10_000_000,
+                        confidence: float = 0.95, executor: futures.Executor = None,
+                        tasks: int = None, seed=None) -> DistributionEstimate:
+    """
+    Estimates the probability of each total value when picking cards without
+    replacement by sampling. Samples are drawn in batches until the
+    confidence interval of the EV is narrower than the target precision, the
+    time budget runs out or max_samples is reached.
+    :param value_counts: Mapping of value to number of cards with that value
+    :param picks:        The number of cards picked
+    :param offset:       Value added to every total e.g. sum of face-up cards
+    :param precision:    Target half width of the confidence interval of the EV
+    :param time_budget:  Max time to sample for in seconds
+    :param batch_size:   The number of samples drawn by each task
+    :param max_samples:  Max number of samples
+    :param confidence:   Confidence level of the intervals
+    :param executor:     Executor e.g. a process pool the sampling tasks are 
+                         split across, sampled in this process if None
+    :param tasks:        The number of tasks sampled in parallel per batch, 
+                         the number of workers of the executor if None
+    :param seed:         Seed the independent stream of each task is spawned from
+    :return:             The estimated distribution
+    """
+    if picks < 0 or picks > sum(value_counts.values()):
+        raise ValueError(f'Cannot pick {picks} cards from '
+                         f'{sum(value_counts.values())} cards')
+
+    if tasks is None:
+        tasks = getattr(executor, '_max_workers', 1) if executor is not None else 1
+
+    start = time.perf_counter()
+    values = np.repeat(np.array(list(value_counts), dtype=np.int64),
+                       list(value_counts.values()))
+    seeds = np.random.SeedSequence(seed)
+    counts = np.zeros(picks * int(values.max(initial=0)) + 1, dtype=np.int64)
+    while True:
+        task_seeds = seeds.spawn(tasks)
+        if executor is None:
+            results = [sample_totals(values, picks, batch_size, task_seed)
+                       for task_seed in task_seeds]
+        else:
+            results = executor.map(sample_totals, [values] * tasks, [picks] * tasks,
+                                   [batch_size] * tasks, task_seeds)
+        for result in results:
+            counts += result
+
+        estimate = DistributionEstimate(counts, offset, confidence)
+        estimate.elapsed = time.perf_counter() - start
+        estimate.converged = estimate.ev_half_width() <= precision
+        if (estimate.converged or estimate.elapsed >= time_budget
+                or estimate.samples >= max_samples):
+            return estimate
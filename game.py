@@ -5,16 +5,25 @@ Date: 05/04/24
 Market making card game
 """
 
-import copy
+import argparse
+import os
 import random as rand
+import selectors
+import sys
 import time
 import threading
-import re
 
 import display
+from cache import StateCache, shared_cache
+from charts import ChartRenderer
+from instrumentation import Instrumentation, instruments
+import validation
 from round import Round
-from deck import Card, Deck
+from deck import Card, Deck, DeckSpec, Shoe, load_deck_spec
+from knowledge import KnowledgeState
 from player import Player
+from recorder import RoundRecorder, new_session_id, print_records
+from streams import RandomStream
 
 """
 Game settings
@@ -23,12 +32,34 @@ CARDS_PER_ROUND = 3
 ROUNDS = 3
 TIME_LIMIT = 60
 
+STAGED_REVEALS = False
+
 MARKET_EVENTS = False
 MARKET_EVENT_CHANCE = 0.5
 
 START_BALANCE = 500
 SHOW_BALANCE = True
 
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+ROUND_LOG = f'{DIR_PATH}/round_log.jsonl'
+ROUND_LOG_FORMAT = 'jsonl'
+
+METRICS_PATH = None
+METRICS_FORMAT = 'json'
+METRICS_INTERVAL = 10
+DECK = 1
+
+# Share calculations between rounds and sessions with the same knowledge state
+CACHE = True
+
+CHARTS = True
+# Estimate the charted value distribution by sampling, split across a 
+# process pool of SAMPLING_PROCESSES workers, one per CPU if None
+APPROXIMATE = False
+SAMPLING_PROCESSES = None
+CHART_FORMAT = 'png'
+BATCH_CHARTS = False
+
 SUITS = {1: ['♥', '♦', '♣', '♠'],
          2: ['🐄', '🐍', '🐕', '🐬', '🐞'],
          3: ['⚽', '⭐', '❌', '🔶', '✅', '♒', '🔵']}
@@ -40,56 +71,336 @@ RANKS = {1: list(map(str, range(2, 11))) + ['J', 'Q', 'K', 'A'],
 FACE_CARD_VALUES = {1: {'J': 11, 'Q': 12, 'K': 13, 'A': 14}, 
                     2: {'A': 1, 'J': 11, 'Q': 12, 'K': 13}}
 
-# TODO: Timer
-class Timer:
-    def __init__(self, turn_time = 0) -> None:
-        self.turn_time = turn_time
-
+# Deck configuration file played instead of DECK if set
+DECK_CONFIG = None
 
-def main() -> None:
-    display.print_title()
-
-    ranks, suits, face_card_values = RANKS[1], SUITS[1], FACE_CARD_VALUES[1]
+# Copies of the deck in the shoe, a single deck played through once if 1.
+# A shoe is reshuffled once the penetration fraction of it has been dealt.
+SHOE_DECKS = 1
+SHOE_PENETRATION = 0.75
 
-    display.show_settings(cards_per_round=CARDS_PER_ROUND, rounds=ROUNDS, 
-                          time_limit=TIME_LIMIT, market_events=MARKET_EVENTS, 
-                          start_balance=START_BALANCE, show_balance=SHOW_BALANCE)
-    display.show_card_values(suits, ranks, face_card_values)
+def get_card_values(ranks: list[str], face_card_values: dict[str, int]) -> dict[str, int]:
+    """
+    Creates the mapping of rank to value.
+    :param ranks:            The list of ranks
+    :param face_card_values: Mapping of face card rank to value
+    :return:                 Mapping of rank to value
+    """
     values = {}
     for rank in ranks:
         if rank.isnumeric():
             values[rank] = int(rank)
         else:
             values[rank] = face_card_values[rank]
+    return values
+
+
+# Compiled built-in decks by key of RANKS
+_deck_specs: dict[int, DeckSpec] = {}
+
+
+def get_deck_spec(deck=DECK) -> DeckSpec:
+    """
+    Returns the compiled deck, which is only built the first time.
+    :param deck: Key of RANKS for a built-in deck or the path of a deck 
+                 configuration file
+    :return:     The compiled deck shared by every round and session
+    """
+    if isinstance(deck, str):
+        return load_deck_spec(deck)
+    spec = _deck_specs.get(deck)
+    if spec is None:
+        values = get_card_values(RANKS[deck], FACE_CARD_VALUES.get(deck, {}))
+        spec = _deck_specs[deck] = DeckSpec(RANKS[deck], SUITS[deck], values, f'Deck {deck}')
+    return spec
+
+
+def new_game_deck(spec: DeckSpec, rng: rand.Random = None, decks: int = None):
+    """
+    Creates the shuffled deck of a game, a shoe if there are several decks.
+    :param spec:  The compiled deck
+    :param rng:   Random number generator of the session
+    :param decks: The number of copies of the deck, SHOE_DECKS if None
+    :return:      Tuple (game deck, knowledge of its unseen cards)
+    """
+    decks = decks if decks is not None else SHOE_DECKS
+    if decks > 1:
+        game_deck = Shoe(spec, decks, rng, SHOE_PENETRATION)
+    else:
+        game_deck = Deck(rng=rng, spec=spec)
+        game_deck.shuffle()
+    return game_deck, KnowledgeState(spec, spec.card_values, decks)
+
+
+def deal_round(round_num: int, game_deck: Deck, spec: DeckSpec, knowledge: KnowledgeState,
+               seen_cards: set[int], cache: StateCache = None,
+               market_events: bool = MARKET_EVENTS, rng: rand.Random = None) -> Round:
+    """
+    Creates a round, picks its cards from the game deck and randomly turns 
+    cards face-up. Cards seen in earlier rounds of the game stay seen. With 
+    market events, the event is rolled first and only cards it allows are 
+    picked. A shoe which has reached its cut card is reshuffled first, and
+    every card becomes unseen again.
+    :param spec: The compiled deck used as the full deck of the round
+    :param rng:  Random number generator of the session, the global random 
+                 module if None
+    :return:     The new round
+    """
+    if game_deck.needs_reshuffle():
+        game_deck.shuffle()
+        knowledge.reset()
+        seen_cards.clear()
+    round = Round(round_num=round_num, const_deck=spec, picked_cards=[],
+                  is_face_up=[], card_values=spec.card_values, seen_cards=seen_cards,
+                  market_events_enabled=market_events, knowledge=knowledge, cache=cache,
+                  rng=rng)
+    round.roll_market_event(MARKET_EVENT_CHANCE)
+    allowed = round.market_event.allowed if round.market_event else None
+    with instruments.timer('deal'):
+        for card in game_deck.deal(CARDS_PER_ROUND, allowed):
+            round.add_card(card)
+    round.rand_face_up()
+    return round
+
+
+"""
+Class to represent the time limit of a player's turn. Answers are read from 
+the stream with a selector instead of a blocking input(), so a turn ends at
+its deadline even if the player has not pressed enter. Input typed before 
+a turn starts, e.g. an answer typed just after the last turn ran out, is 
+discarded so it cannot be taken as the answer to the new turn. Where the stream 
+cannot be selected on, e.g. any stream on Windows where selectors only 
+accept sockets, answers are read with a blocking readline and the limit is 
+not enforced.
+"""
+class Timer:
+    def __init__(self, turn_time = 0, stream = None) -> None:
+        """
+        :param turn_time:  The time limit of a turn in seconds, no limit if 0
+        :param stream:     The stream answers are read from, sys.stdin if None
+        :param start_time: When the turn started
+        :param deadline:   When the turn ends, None if there is no limit
+        :param buffer:     Bytes read from the stream after the last answer
+        :param timed_out:  The last turn ended before it was answered
+        """
+        self.turn_time: float = turn_time
+        self.stream = stream if stream is not None else sys.stdin
+        self.start_time: float = 0
+        self.deadline: float = None
+        self.buffer: bytes = b''
+        self.timed_out: bool = False
+        self.selector: selectors.BaseSelector = None
+        self.fd: int = None
+
+    def start(self) -> None:
+        """
+        Starts a turn, discarding input typed ahead at a console or left 
+        from a turn which ran out of time. Piped answers of a turn which 
+        was answered are kept, so scripted games still play through.
+        """
+        if self.timed_out or self.is_console():
+            self.drain()
+        self.timed_out = False
+        self.start_time = time.monotonic()
+        self.deadline = self.start_time + self.turn_time if self.turn_time > 0 else None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def remaining(self) -> float:
+        """
+        :return: Seconds left in the turn, None if there is no limit
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def input(self, prompt: str = '', limit: bool = True) -> str:
+        """
+        Reads an answer before the turn ends.
+        :param prompt: Printed before reading
+        :param limit:  Stop at the deadline of the turn (True) or wait for an
+                       answer however long it takes (False)
+        :return:       The answer without the line ending, or None if the 
+                       turn ended first
+        """
+        print(prompt, end='', flush=True)
+        line = self.read_line(self.deadline if limit else None)
+        if line is None:
+            self.timed_out = True
+            print()
+        return line
+
+    def read_line(self, deadline: float = None) -> str:
+        """
+        Reads a line from the stream without blocking past the deadline.
+        :param deadline: time.monotonic() to stop at, no limit if None
+        :return:         The line, or None if the deadline passed first
+        """
+        if self.fd is None:
+            self.open_selector()
+        if self.selector is None:
+            line = self.stream.readline()
+            if not line:
+                raise EOFError
+            return line.rstrip('\r\n')
+
+        # Lines are split from a buffer of raw reads, as a buffered reader 
+        # could hold lines the selector does not know about
+        while b'\n' not in self.buffer:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and (timeout <= 0 or not self.selector.select(timeout)):
+                return None
+            if timeout is None:
+                self.selector.select()
+            chunk = os.read(self.fd, 4096)
+            if not chunk:
+                if not self.buffer:
+                    raise EOFError
+                self.buffer += b'\n'
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line.decode(errors='replace').rstrip('\r')
+
+    def is_console(self) -> bool:
+        try:
+            return self.stream.isatty()
+        except (AttributeError, ValueError):
+            return False
+
+    def drain(self) -> None:
+        """
+        Discards the input which has not been read.
+        """
+        self.buffer = b''
+        if self.fd is None:
+            self.open_selector()
+        if self.selector is not None:
+            while self.selector.select(0):
+                if not os.read(self.fd, 4096):
+                    # The end of the stream is left for read_line to find
+                    break
+        elif sys.platform == 'win32' and self.is_console():
+            import msvcrt
+
+            while msvcrt.kbhit():
+                msvcrt.getwch()
+
+    def open_selector(self) -> None:
+        """
+        Registers the stream with a selector, or leaves the selector None if
+        the stream cannot be selected on. The Windows console is accepted by
+        register but fails at select, so it is checked for up front.
+        """
+        self.fd = -1
+        if sys.platform == 'win32':
+            return
+        try:
+            fd = self.stream.fileno()
+        except (AttributeError, OSError, ValueError):
+            return
+        selector = selectors.DefaultSelector()
+        try:
+            selector.register(fd, selectors.EVENT_READ)
+        except (OSError, ValueError):
+            selector.close()
+            return
+        self.fd, self.selector = fd, selector
+
+    def close(self) -> None:
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+
+
+def main(charts: bool = CHARTS, metrics_path: str = METRICS_PATH,
+         metrics_format: str = METRICS_FORMAT, seed: int = None,
+         deck=None, shoe: int = None, approximate: bool = APPROXIMATE) -> None:
+    """
+    Plays a game in the console.
+    :param charts:         Save a histogram of the value distribution each round
+    :param metrics_path:   File the phase timings are dumped to every 
+                           METRICS_INTERVAL seconds, not timed if None
+    :param metrics_format: 'json' or 'prometheus'
+    :param seed:           Seed of the session, the same seed and inputs replay
+                           the same game. A random seed is chosen if None.
+    :param deck:           Key of RANKS or the path of a deck configuration 
+                           file, DECK_CONFIG or DECK if None
+    :param shoe:           The number of decks in the shoe, SHOE_DECKS if None
+    :param approximate:    Estimate the value distribution by sampling (True)
+                           or calculate it exactly (False)
+    """
+    # The same stream as the first game of a batch.py script with the seed
+    rng = RandomStream(seed).spawn('game', 1)
+    if metrics_path:
+        instruments.enabled = True
+        instruments.start_periodic_dump(metrics_path, METRICS_INTERVAL, metrics_format)
+
+    display.print_title()
+
+    if deck is None:
+        deck = DECK_CONFIG if DECK_CONFIG else DECK
+    spec = get_deck_spec(deck)
+
+    display.show_settings(cards_per_round=CARDS_PER_ROUND, rounds=ROUNDS, 
+                          time_limit=TIME_LIMIT, staged_reveals=STAGED_REVEALS,
+                          market_events=MARKET_EVENTS, 
+                          start_balance=START_BALANCE, show_balance=SHOW_BALANCE,
+                          charts=charts, approximate=approximate)
+    display.show_card_values(spec.suits, spec.ranks, spec.card_values)
 
     display.print_instructions()
 
     # Instantiate deck and player
-    game_deck = Deck(ranks, suits)
-    game_deck.shuffle()
+    game_deck, knowledge = new_game_deck(spec, rng, shoe)
     player = Player(START_BALANCE)
+    renderer = ChartRenderer(fmt=CHART_FORMAT, batch=BATCH_CHARTS) if charts else None
+    # Only the charted distribution is estimated, so without charts there
+    # is nothing to sample
+    sampler = None
+    if approximate and charts:
+        from concurrent.futures import ProcessPoolExecutor
+
+        sampler = ProcessPoolExecutor(SAMPLING_PROCESSES)
+    seen_cards = set()
+
+    # Each finished round is appended to the round log, and its record is
+    # kept for the summary so the log is not read back
+    session = new_session_id()
+    recorder = RoundRecorder(ROUND_LOG, ROUND_LOG_FORMAT, CARDS_PER_ROUND)
+    records = []
 
-    round_history: list[Round] = []  # History of rounds
+    # The time the player takes to decide and the time the engine takes to
+    # quote are always recorded, and are added to the metrics if timed
+    timer = Timer(TIME_LIMIT)
+    latency = Instrumentation(enabled=True)
+    if instruments.enabled:
+        latency.add_hook(instruments.observe)
 
     curr_round = 1  # Round number
-    while curr_round <= ROUNDS and len(game_deck.deck) > 0:
+    while curr_round <= ROUNDS and len(game_deck) > 0:
         display.print_divider()
         print(f'Round {curr_round}', '\n')
+        round_start = time.perf_counter()
 
         # Create round and pick cards
-        round = Round(round_num=curr_round, const_deck=Deck(ranks, suits), card_values=values)
-        for _ in range(CARDS_PER_ROUND):
-            card = game_deck.pick_card()
-            if card:
-                round.add_card(card)
-        round.rand_face_up()
+        round = deal_round(curr_round, game_deck, spec, knowledge, seen_cards,
+                           shared_cache if CACHE else None, rng=rng)
+        if round.market_event:
+            print(f'Market event: {round.market_event}', '\n')
         print('Cards this round:\n', round.show_round(), '\n', sep='')
         round.calculate_ev()
-        round.calculate_value_distribution()
+        if charts:
+            round.calculate_value_distribution(renderer=renderer, approximate=approximate,
+                                               executor=sampler)
         # print('EV =', f'{round.ev:.2f}','\n')
         
         # Market maker quotes
         bid, ask = round.calculate_spread()
+        latency.observe('quote', time.perf_counter() - round_start)
         print(f'Market maker quotes {bid} at {ask}\n')
         
         if SHOW_BALANCE:
@@ -98,25 +409,52 @@ def main() -> None:
         
         # Player trades
         print('Buy (B) / Sell (S) / Pass (P) followed by how many units e.g. B,10 or S,5')
+        if STAGED_REVEALS:
+            print('Next (N) reveals the next card and the market maker requotes')
+        if TIME_LIMIT:
+            print(f'You have {TIME_LIMIT} seconds')
+        timer.start()
         while True:
-            user_in = input('Place order >>> ')
-            if user_in.lower().strip() == 'p':
+            with instruments.timer('player_order'):
+                user_in = timer.input('Place order >>> ')
+            if user_in is None:
+                print('Time is up, the order is passed')
                 round.place_order('Pass', 0)
                 break
+            order = validation.parse_order(user_in)
+            if order is None or (order[0] == 'Next' and not STAGED_REVEALS):
+                print("Invalid input")
+                continue
 
-            match = re.match(r'[bs][,][1-9]\d*', user_in)
-            if match:
-                action, units = match.group().split(',')
-                if action.lower() == 'b':
-                    if round.place_order('Buy', int(units)):
-                        break
-                    print('Long position exceeds balance')
-                elif action.lower() == 's':
-                    if round.place_order('Sell', int(units)):
-                        break
-                    print('Short position exceeds balance')
+            action, units = order
+            if action == 'Pass':
+                round.place_order('Pass', 0)
+                break
+
+            if action == 'Next':
+                if round.face_down_count() > 1:
+                    quote_start = time.perf_counter()
+                    round.reveal_next_card()
+                    print('\nCards this round:\n', round.show_round(), '\n', sep='')
+                    round.calculate_ev()
+                    if charts:
+                        round.calculate_value_distribution(renderer=renderer,
+                                                           approximate=approximate,
+                                                           executor=sampler)
+                    bid, ask = round.calculate_spread()
+                    latency.observe('quote', time.perf_counter() - quote_start)
+                    print(f'Market maker quotes {bid} at {ask}\n')
+                else:
+                    print('No more cards are revealed this round')
+                continue
+
+            if round.place_order(action, units):
+                break
+            if action == 'Buy':
+                print('Long position exceeds balance')
             else:
-                print("Invalid input")
+                print('Short position exceeds balance')
+        latency.observe('player_decision', timer.elapsed())
             
         # Reveal true market price
         print('\nCard Reveal')
@@ -126,10 +464,11 @@ def main() -> None:
         if round.order != 'Pass':
             print('Enter profit/loss (-ve is loss)')
             while True:
-                user_in = input('>>> ')
-                match = re.match(r'[-]?[1-9]+\d*', user_in)
-                if match:
-                    round.player_input_pl = int(match.group())
+                with instruments.timer('player_pl'):
+                    user_in = timer.input('>>> ', limit=False)
+                pl = validation.parse_pl(user_in)
+                if pl is not None:
+                    round.player_input_pl = pl
                     break
                 else:
                     print("Invalid input")
@@ -141,19 +480,50 @@ def main() -> None:
         if SHOW_BALANCE:
             print('Balance: ', player.balance)
 
-        # Append a copy of the round to the round history
-        round_history.append(copy.deepcopy(round))
+        # Append the round to the round log
+        records.append(recorder.record(round, session, deck if isinstance(deck, int) else 0))
         round.clear_cards()
+        if instruments.enabled:
+            instruments.observe('round', time.perf_counter() - round_start)
         curr_round += 1
 
+    if renderer:
+        renderer.close()
+    if sampler:
+        sampler.shutdown()
+    recorder.close()
+    timer.close()
+    if metrics_path:
+        instruments.stop_periodic_dump()
+        instruments.dump(metrics_path, metrics_format)
+
     # Display post-game summary
     display.print_divider()
     print('Game summary')
-    for round in round_history:
-        print(str(round), '\n')
+    print_records(records, game_deck.cards)
+    display.show_latency(latency.to_dict())
+    print(f'Seed: {rng.root_seed}')
         
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Market making card game')
+    parser.add_argument('--no-charts', action='store_true',
+                        help='do not save value distribution charts')
+    parser.add_argument('--metrics', default=METRICS_PATH,
+                        help='file the phase timings are dumped to')
+    parser.add_argument('--metrics-format', default=METRICS_FORMAT,
+                        choices=['json', 'prometheus'])
+    parser.add_argument('--seed', type=int, default=None,
+                        help='replay the game of a seed')
+    parser.add_argument('--deck-config', default=None,
+                        help='JSON or TOML deck configuration file to play with')
+    parser.add_argument('--shoe', type=int, default=None,
+                        help='play from a shoe of this many decks')
+    parser.add_argument('--approximate', action='store_true', default=APPROXIMATE,
+                        help='estimate the value distribution by sampling in a process pool')
+    args = parser.parse_args()
+    main(charts=CHARTS and not args.no_charts, metrics_path=args.metrics,
+         metrics_format=args.metrics_format, seed=args.seed, deck=args.deck_config,
+         shoe=args.shoe, approximate=args.approximate)
 
 
@@ -0,0 +1,224 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The instrumentation module times the phases of a round. Each phase keeps a
+call counter, total time and a latency histogram which can be dumped to a
+file as JSON or Prometheus text. Instrumentation is disabled by default
+and costs a single flag check per phase while disabled.
+"""
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+           0.1, 0.5, 1.0, 5.0, 30.0, 60.0)
+
+FORMATS = ('json', 'prometheus')
+
+"""
+Class to represent the timings of one phase.
+"""
+class PhaseStats:
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self) -> None:
+        """
+        :param count:   The number of times the phase ran
+        :param total:   The total time in seconds
+        :param max:     The longest time in seconds
+        :param buckets: Number of times in each histogram bucket, the last
+                        bucket is for times above every bound
+        """
+        self.count: int = 0
+        self.total: float = 0
+        self.max: float = 0
+        self.buckets: list[int] = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.buckets[bisect_left(BUCKETS, elapsed)] += 1
+
+    def to_dict(self) -> dict:
+        return {'count': self.count,
+                'total_s': self.total,
+                'mean_s': self.total / self.count if self.count else 0,
+                'max_s': self.max,
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'],
+                                    self.buckets))}
+
+
+"""
+Class to represent a timer of a phase used as a context manager.
+"""
+class PhaseTimer:
+    __slots__ = ('instruments', 'phase', 'start')
+
+    def __init__(self, instruments: 'Instrumentation', phase: str) -> None:
+        self.instruments = instruments
+        self.phase = phase
+        self.start = 0
+
+    def __enter__(self) -> 'PhaseTimer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.instruments.observe(self.phase, time.perf_counter() - self.start)
+
+
+"""
+Class to represent a timer which does nothing while instrumentation is
+disabled.
+"""
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> 'NullTimer':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+"""
+Class to represent a registry of phase timings and hooks.
+"""
+class Instrumentation:
+    def __init__(self, enabled: bool = False) -> None:
+        """
+        :param enabled: Record timings (True) or not (False)
+        :param phases:  Mapping of phase name to timings
+        :param hooks:   Callables taking (phase, elapsed seconds) which are
+                        called after each timed phase
+        """
+        self.enabled: bool = enabled
+        self.phases: dict[str, PhaseStats] = {}
+        self.hooks: list = []
+        self.lock = threading.Lock()
+        self.dump_thread: threading.Thread = None
+        self.dump_stop = threading.Event()
+
+    def timer(self, phase: str):
+        """
+        Times a phase e.g. with instruments.timer('deal'): ...
+        :param phase: The phase name
+        :return:      Context manager timing the phase
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return PhaseTimer(self, phase)
+
+    def observe(self, phase: str, elapsed: float) -> None:
+        """
+        Records the time of a phase.
+        :param phase:   The phase name
+        :param elapsed: The time in seconds
+        """
+        with self.lock:
+            stats = self.phases.get(phase)
+            if stats is None:
+                stats = self.phases[phase] = PhaseStats()
+            stats.observe(elapsed)
+        for hook in self.hooks:
+            hook(phase, elapsed)
+
+    def add_hook(self, hook) -> None:
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook) -> None:
+        self.hooks.remove(hook)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.phases.clear()
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {phase: stats.to_dict() for phase, stats in self.phases.items()}
+
+    def to_json(self) -> str:
+        import json
+
+        return json.dumps({'time': time.time(), 'phases': self.to_dict()}, indent=2)
+
+    def to_prometheus(self, prefix: str = 'market_game') -> str:
+        """
+        Formats the timings as Prometheus text exposition.
+        :return: String of histogram metrics labelled by phase
+        """
+        name = f'{prefix}_phase_seconds'
+        lines = [f'# HELP {name} Time spent in each phase of a round.',
+                 f'# TYPE {name} histogram']
+        for phase, stats in self.to_dict().items():
+            cumulative = 0
+            for bound, count in stats['buckets'].items():
+                cumulative += count
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {stats["total_s"]}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str, fmt: str = 'json') -> None:
+        """
+        Writes the timings to a file, replacing it.
+        :param path: The file path
+        :param fmt:  'json' or 'prometheus'
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f'Metrics format must be one of {", ".join(FORMATS)}')
+        text = self.to_json() if fmt == 'json' else self.to_prometheus()
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+    def start_periodic_dump(self, path: str, interval: float = 10,
+                            fmt: str = 'json') -> None:
+        """
+        Writes the timings to a file every interval seconds on a background
+        thread until stop_periodic_dump is called.
+        """
+        def run() -> None:
+            while not self.dump_stop.wait(interval):
+                self.dump(path, fmt)
+
+        self.dump_stop.clear()
+        self.dump_thread = threading.Thread(target=run, daemon=True)
+        self.dump_thread.start()
+
+    def stop_periodic_dump(self) -> None:
+        if self.dump_thread:
+            self.dump_stop.set()
+            self.dump_thread.join()
+            self.dump_thread = None
+
+
+# Instrumentation shared by the game modules
+instruments = Instrumentation()
+
+
+def timed(phase: str):
+    """
+    Decorates a function so each call is timed as a phase of the shared
+    instrumentation.
+    :param phase: The phase name
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not instruments.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                instruments.observe(phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
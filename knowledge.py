@@ -0,0 +1,118 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The knowledge module tracks what is known about the unseen cards so that
+EV, max value and the value distribution can be updated card by card. The
+unseen cards are kept as counts, so the knowledge of a shoe of many decks
+is the same size as the knowledge of one deck.
+"""
+from deck import Deck, DeckSpec
+
+"""
+Class to represent the knowledge of seen and unseen cards.
+"""
+class KnowledgeState:
+    def __init__(self, deck: Deck = None, card_values: dict[str, int] = None,
+                 copies: int = 1) -> None:
+        """
+        :param deck:           The full deck of cards
+        :param card_values:    Mapping of rank to value
+        :param copies:         The number of copies of the deck e.g. the 
+                               decks of a Shoe
+        :param value_table:    List where index is the card ID and element is the value
+        :param seen:           Bitset of seen card IDs of a single deck
+        :param card_counts:    List where index is the card ID and element is 
+                               the number of unseen copies, None for a single 
+                               deck which uses the seen bitset
+        :param unseen_sum:     The sum of values of unseen cards
+        :param unseen_count:   The number of unseen cards
+        :param value_counts:   Mapping of value to number of unseen cards
+        :param values_desc:    The distinct card values sorted from highest
+        :param deck_signature: Tuple of (value, count) of the full deck
+        """
+        self.value_table: list[int] = deck.value_table(card_values) if deck else []
+        self.copies: int = copies
+        self.seen: int = 0
+        self.card_counts: list[int] = [copies] * len(self.value_table) if copies > 1 else None
+        self.unseen_count: int = len(self.value_table) * copies
+
+        if isinstance(deck, DeckSpec) and deck.is_deck_values(card_values):
+            # Start from the totals compiled into the deck
+            self.unseen_sum: int = deck.total * copies
+            self.value_counts: dict[int, int] = {value: count * copies
+                                                 for value, count in deck.histogram.items()}
+            self.deck_signature: tuple = (deck.signature if copies == 1 
+                                          else tuple(self.value_counts.items()))
+        else:
+            self.unseen_sum: int = sum(self.value_table) * copies
+            self.value_counts: dict[int, int] = self.count_values()
+            self.deck_signature: tuple = tuple(sorted(self.value_counts.items()))
+        self.values_desc: list[int] = sorted(self.value_counts, reverse=True)
+
+    def count_values(self) -> dict[int, int]:
+        """
+        Counts how many cards of the full deck and its copies there are of 
+        each value.
+        """
+        value_counts = {}
+        for value in self.value_table:
+            value_counts[value] = value_counts.get(value, 0) + self.copies
+        return value_counts
+
+    def reset(self) -> None:
+        """
+        Marks every card as unseen e.g. after a shoe is reshuffled.
+        """
+        self.seen = 0
+        if self.card_counts is not None:
+            self.card_counts = [self.copies] * len(self.value_table)
+        self.unseen_count = len(self.value_table) * self.copies
+        self.unseen_sum = sum(self.value_table) * self.copies
+        self.value_counts = self.count_values()
+
+    def is_seen(self, card_id: int) -> bool:
+        return bool(self.seen >> card_id & 1)
+
+    def reveal(self, card_id: int) -> bool:
+        """
+        Marks a card as seen. With copies of the deck, each call marks one 
+        more copy as seen, so the caller must only reveal each dealt card 
+        once.
+        :param card_id: The card ID
+        :return:        True if the card was not already seen
+        """
+        if self.copies == 1:
+            if self.seen >> card_id & 1:
+                return False
+            self.seen |= 1 << card_id
+        else:
+            if not self.card_counts[card_id]:
+                return False
+            self.card_counts[card_id] -= 1
+        value = self.value_table[card_id]
+        self.unseen_sum -= value
+        self.unseen_count -= 1
+        self.value_counts[value] -= 1
+        return True
+
+    def ev_unseen(self) -> float:
+        """
+        Calculates the expected value of an unseen card.
+        :return: The mean value of the unseen cards
+        """
+        return self.unseen_sum / self.unseen_count
+
+    def top_values(self, count: int) -> list[int]:
+        """
+        Lists the highest values of the unseen cards, stopping once there 
+        are enough, so the cost does not grow with the number of copies.
+        :param count: The number of values
+        :return:      List of up to count unseen card values sorted from highest
+        """
+        top = []
+        for value in self.values_desc:
+            if len(top) >= count:
+                break
+            top.extend([value] * min(self.value_counts[value], count - len(top)))
+        return top
@@ -0,0 +1,115 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The load_test module plays many concurrent sessions against the game server
+and measures sessions per second and server response latency.
+"""
+import argparse
+import asyncio
+import random as rand
+import statistics
+import time
+
+import game
+import server
+
+ORDERS = ['P', 'B,1', 'S,1']
+
+
+async def run_client(host: str, port: int, latencies: list[float]) -> bool:
+    """
+    Plays one session with random orders.
+    :param latencies: List the response latency of each answer is added to
+    :return:          True if the session reached the end
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        sent = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                return False
+            if sent is not None:
+                latencies.append(time.perf_counter() - sent)
+                sent = None
+
+            message, _, seq = line.decode().strip().partition(' ')
+            if message == 'ORDER':
+                answer = rand.choice(ORDERS)
+            elif message == 'PL':
+                answer = '1'
+            elif message == 'END':
+                return True
+            else:
+                continue
+            writer.write(f'{seq} {answer}\n'.encode())
+            await writer.drain()
+            sent = time.perf_counter()
+    finally:
+        writer.close()
+
+
+async def run_load_test(host: str, port: int, sessions: int, concurrency: int) -> dict:
+    """
+    Plays sessions against the server with a limited number at once.
+    :return: Dictionary of results
+    """
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited() -> bool:
+        async with semaphore:
+            return await run_client(host, port, latencies)
+
+    start = time.perf_counter()
+    completed = await asyncio.gather(*(limited() for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    quantiles = [0] * 99
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'sessions': sessions,
+            'completed': sum(completed),
+            'elapsed': elapsed,
+            'sessions_per_sec': sessions / elapsed,
+            'latency_p50_ms': quantiles[49] * 1000,
+            'latency_p99_ms': quantiles[98] * 1000,
+            'latency_max_ms': (latencies[-1] if latencies else 0) * 1000}
+
+
+async def run_local(sessions: int, concurrency: int) -> dict:
+    """
+    Starts a server on a free port in this process and load tests it.
+    """
+    local = server.GameServer(game.get_deck_spec(1), port=0)
+    await local.start()
+    try:
+        return await run_load_test(local.host, local.port, sessions, concurrency)
+    finally:
+        await local.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test the game server')
+    parser.add_argument('--host', default=server.HOST)
+    parser.add_argument('--port', type=int, default=server.PORT)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--local', action='store_true',
+                        help='start a server in this process')
+    args = parser.parse_args()
+
+    if args.local:
+        results = asyncio.run(run_local(args.sessions, args.concurrency))
+    else:
+        results = asyncio.run(run_load_test(args.host, args.port, args.sessions,
+                                            args.concurrency))
+    for name, val in results.items():
+        print(f'{name.replace("_", " ").capitalize():<18}',
+              f'{val:.2f}' if type(val) is float else val)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,13 @@ Alson Lee
 Date: 05/04/24
 
 The market_event module contains methods for market events.
+
+A market event is compiled against the value table of a deck. Deck
+restrictions become a bitmask of the card IDs which can be dealt and card
+modifiers become a mapping of old to new card values. Where an event treats
+every card of a value the same way, the unseen value counts of a round are
+transformed per value rather than per card.
 """
-from collections import deque
 import random as rand
 
 from deck import Deck
@@ -13,9 +18,14 @@ from deck import Deck
 Class to represent a deck restriction market event.
 """
 class EventDeckRestriction:
-    def __init__(self, description='', 
-                 restrict_card_ranks = [], 
-                 restrict_card_suits = []) -> None:
+    def __init__(self, description='',
+                 restrict_card_ranks = None,
+                 restrict_card_suits = None) -> None:
+        """
+        :param description:         The event description
+        :param restrict_card_ranks: The ranks which can be dealt, any if None
+        :param restrict_card_suits: The suits which can be dealt, any if None
+        """
         self.description = description
         self.restrict_card_ranks = restrict_card_ranks
         self.restrict_card_suits = restrict_card_suits
@@ -25,10 +35,14 @@ class EventDeckRestriction:
 Class to represent a card modifier market event.
 """
 class EventCardModifier:
-    def __init__(self, description='', 
-                 modify_card_value={}) -> None:
+    def __init__(self, description='',
+                 modify_card_value=None) -> None:
+        """
+        :param description:       The event description
+        :param modify_card_value: Mapping of rank to its new value
+        """
         self.description = description
-        self.modify_card_value = modify_card_value
+        self.modify_card_value = modify_card_value if modify_card_value else {}
 
 
 """
@@ -44,26 +58,212 @@ class MarketEvent:
                      201: EventCardModifier('Even cards are now worth double'),
                      202: EventCardModifier('Odd cards are now worth double')}
 
-    def __init__(self, event_id=0, event_chance=0.5, 
-                 deck=None) -> None:
+    def __init__(self, event_id=0, event_chance=0.5,
+                 deck=None, card_values=None, rng=None) -> None:
+        """
+        :param event_id:     The preset event ID, 0 for no event
+        :param event_chance: The chance of an event in random_event
+        :param deck:         The full deck of cards
+        :param card_values:  Mapping of rank to value without the event
+        :param rng:          Random number generator e.g. a 
+                             streams.RandomStream, the global random module 
+                             if None
+        :param event_data:   The event with the ranks, suits or values it
+                             applies to
+        :param allowed:      Bitmask of the card IDs which can be dealt
+        :param value_map:    Mapping of every card value to its value with the
+                             event, None if cards of a value are treated
+                             differently
+        """
         self.event_id = event_id
         self.event_data = None
         self.event_chance = event_chance
-        self.deck: deque = deck
+        self.deck: Deck = deck
+        self.card_values: dict[str, int] = card_values if card_values else {}
+        self.rng: rand.Random = rng if rng is not None else rand
+
+        self.value_table: list[int] = []
+        self.allowed: int = 0
+        self.allowed_values: set[int] = None
+        self.value_map: dict[int, int] = {}
+        self.event_values: dict[str, int] = dict(self.card_values)
+        if event_id:
+            self.set_event(event_id)
+
+    def __str__(self) -> str:
+        return self.describe()
 
     def get_event(self):
-        pass
+        return self.event_data
+
+    def random_event(self) -> int:
+        """
+        Rolls for a random preset event.
+        :return: The event ID, 0 for no event
+        """
+        if self.rng.random() < self.event_chance:
+            self.set_event(self.rng.choice(list(self.PRESET_EVENTS.keys())))
+        return self.event_id
+
+    def set_event(self, event_id: int) -> None:
+        """
+        Sets a preset event, randomly choosing the cards it applies to, and
+        compiles it against the deck.
+        :param event_id: The preset event ID
+        """
+        preset = self.PRESET_EVENTS[event_id]
+        ranks = self.deck.ranks if self.deck else []
+        suits = self.deck.suits if self.deck else []
+        values = sorted(set(self.card_values.values()))
+
+        if event_id == 100:
+            event = EventDeckRestriction(preset.description,
+                                         [rank for rank in ranks if self.card_values[rank] % 2])
+        elif event_id == 101:
+            event = EventDeckRestriction(preset.description,
+                                         [rank for rank in ranks if not self.card_values[rank] % 2])
+        elif event_id == 110:
+            restrict = self.rng.sample(suits, k=max(1, len(suits) // 2))
+            event = EventDeckRestriction(preset.description,
+                                         restrict_card_suits=[suit for suit in suits
+                                                              if suit in restrict])
+        elif event_id in (120, 121):
+            # X is kept in the middle half of the values so enough cards remain
+            limit = self.rng.choice(values[len(values) // 4:len(values) - len(values) // 4])
+            event = EventDeckRestriction(
+                preset.description.replace('X', str(limit)),
+                [rank for rank in ranks
+                 if (self.card_values[rank] <= limit if event_id == 120
+                     else self.card_values[rank] >= limit)])
+        elif event_id == 200:
+            rank = self.rng.choice(ranks)
+            value = self.rng.randint(values[0], values[-1])
+            event = EventCardModifier(preset.description.replace('X', rank)
+                                      .replace('Y', str(value)), {rank: value})
+        else:
+            is_odd = event_id == 202
+            event = EventCardModifier(preset.description,
+                                      {rank: value * 2 for rank, value in self.card_values.items()
+                                       if value % 2 == is_odd})
+        self.event_id = event_id
+        self.event_data = event
+        self.compile()
+
+    def compile(self) -> None:
+        """
+        Compiles the event into a bitmask of card IDs which can be dealt and
+        a mapping of old to new values.
+        """
+        self.value_table = self.deck.value_table(self.card_values) if self.deck else []
+        self.allowed = (1 << len(self.value_table)) - 1
+        self.allowed_values = None
+        self.value_map = {value: value for value in self.value_table}
+        self.event_values = dict(self.card_values)
+
+        event = self.event_data
+        if isinstance(event, EventDeckRestriction):
+            ranks = set(event.restrict_card_ranks if event.restrict_card_ranks is not None
+                        else self.deck.ranks)
+            suits = set(event.restrict_card_suits if event.restrict_card_suits is not None
+                        else self.deck.suits)
+            self.allowed = 0
+            for card in self.deck.cards:
+                if card.rank in ranks and card.suit in suits:
+                    self.allowed |= 1 << card.card_id
+            if event.restrict_card_suits is None:
+                self.allowed_values = {self.card_values[rank] for rank in ranks}
+                # Cards are only restricted per value if no value has ranks 
+                # which can and cannot be dealt
+                if any(self.card_values[rank] in self.allowed_values
+                       for rank in self.deck.ranks if rank not in ranks):
+                    self.allowed_values = None
+        elif isinstance(event, EventCardModifier):
+            self.event_values.update(event.modify_card_value)
+            self.value_map = {}
+            for rank, value in self.card_values.items():
+                new_value = self.event_values[rank]
+                if self.value_map.setdefault(value, new_value) != new_value:
+                    self.value_map = None
+                    break
+
+    def is_allowed(self, card_id: int) -> bool:
+        return bool(self.allowed >> card_id & 1)
+
+    def is_value_transform(self) -> bool:
+        """
+        Returns True if the event treats every card of a value the same way.
+        """
+        if self.event_data is None:
+            return True
+        if isinstance(self.event_data, EventDeckRestriction):
+            return self.allowed_values is not None
+        return self.value_map is not None
+
+    def transform_counts(self, value_counts: dict[int, int],
+                         seen_cards=None, card_counts: list[int] = None) -> dict[int, int]:
+        """
+        Transforms the unseen value counts of a round for the event.
+        :param value_counts: Mapping of value to number of unseen cards
+                             without the event
+        :param seen_cards:   Set of seen card IDs, only used for events which
+                             treat cards of the same value differently
+        :param card_counts:  List of the number of unseen copies of each card
+                             ID, used instead of seen_cards if given e.g. for
+                             a shoe
+        :return:             Mapping of value to number of unseen cards which
+                             can be dealt, valued with the event
+        """
+        if self.event_data is None:
+            return value_counts
+        if not self.is_value_transform():
+            # Recount the unseen cards which can be dealt one card at a time
+            counts = {}
+            for card in self.deck.cards:
+                if not self.is_allowed(card.card_id):
+                    continue
+                if card_counts is not None:
+                    copies = card_counts[card.card_id]
+                else:
+                    copies = card.card_id not in seen_cards
+                if copies:
+                    value = self.event_values[card.rank]
+                    counts[value] = counts.get(value, 0) + copies
+            return counts
+
+        counts = {}
+        for value, count in value_counts.items():
+            if self.allowed_values is not None and value not in self.allowed_values:
+                continue
+            new_value = self.value_map[value]
+            counts[new_value] = counts.get(new_value, 0) + count
+        return counts
 
-    def random_event(self):
-        if rand.random() < self.event_chance:
-            self.event_id = rand.choice(list(self.PRESET_EVENTS.keys()))
-            self.event_data = self.PRESET_EVENTS[self.event_id]
+    def describe(self) -> str:
+        if self.event_data is None:
+            return 'No market event'
+        event = self.event_data
+        if event.description == self.PRESET_EVENTS[110].description:
+            return event.description.replace('These suits', ''.join(event.restrict_card_suits)
+                                             + ' suits')
+        return event.description
 
-    def get_even_value_cards(self):
-        pass
+    def get_even_value_cards(self) -> list[int]:
+        """
+        Returns the card IDs of cards with an even value.
+        """
+        return [card_id for card_id, value in enumerate(self.value_table) if value % 2 == 0]
 
-    def get_odd_value_cards(self):
-        pass
+    def get_odd_value_cards(self) -> list[int]:
+        """
+        Returns the card IDs of cards with an odd value.
+        """
+        return [card_id for card_id, value in enumerate(self.value_table) if value % 2]
 
-    def get_mod_value_cards(self):
-        pass
\ No newline at end of file
+    def get_mod_value_cards(self) -> list[int]:
+        """
+        Returns the card IDs of cards with a value modified by the event.
+        """
+        if not isinstance(self.event_data, EventCardModifier):
+            return []
+        return [card.card_id for card in self.deck.cards
+                if card.rank in self.event_data.modify_card_value]
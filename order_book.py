@@ -0,0 +1,350 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The order book module lets many players trade the same round with each
+other. Players post limit orders to a price-time priority order book and
+the market maker quote from Round.calculate_spread rests in the book as
+liquidity of unlimited size. An order without a price is placed at the
+market maker quote, so it always fills as Round.place_order does.
+
+Orders are matched at the price of the resting order, best price first and
+oldest first at the same price. An order which would match a resting order
+of the same player cancels the resting order instead. At reveal every
+position is settled at the total value of the cards.
+
+Prices are integers, so each side of the book is a dictionary of price to
+a queue of orders with a heap of the prices. Cancelled orders are left in
+their queue and skipped when they reach the front.
+"""
+import heapq
+from collections import deque
+
+from typing import TYPE_CHECKING
+
+from player import Trader
+from round import Round
+
+if TYPE_CHECKING:
+    from quoting import QuoteConfig
+
+SIDES = ('Buy', 'Sell')
+MAKER = 'Market maker'
+# Size of the market maker quote, large enough to never run out
+MAKER_UNITS = 1 << 62
+
+"""
+Class to represent an order resting in or sent to the order book.
+"""
+class Order:
+    __slots__ = ('order_id', 'trader', 'side', 'price', 'units', 'remaining')
+
+    def __init__(self, order_id: int, trader: Trader, side: str, price: int,
+                 units: int) -> None:
+        """
+        :param order_id:  The order ID, increasing with time
+        :param trader:    The trader who placed the order
+        :param side:      'Buy' or 'Sell'
+        :param price:     The limit price
+        :param units:     The number of units
+        :param remaining: The number of units not filled, 0 when cancelled
+        """
+        self.order_id: int = order_id
+        self.trader: Trader = trader
+        self.side: str = side
+        self.price: int = price
+        self.units: int = units
+        self.remaining: int = units
+
+    def __repr__(self) -> str:
+        return (f'Order({self.order_id}, {self.trader.name!r}, {self.side}, '
+                f'{self.remaining}/{self.units} at {self.price})')
+
+    def filled(self) -> int:
+        return self.units - self.remaining
+
+
+"""
+Class to represent a fill between two orders.
+"""
+class Trade:
+    __slots__ = ('buyer', 'seller', 'price', 'units', 'aggressor')
+
+    def __init__(self, buyer: str, seller: str, price: int, units: int,
+                 aggressor: str) -> None:
+        """
+        :param buyer:     Name of the buying trader
+        :param seller:    Name of the selling trader
+        :param price:     The price of the resting order
+        :param units:     The number of units
+        :param aggressor: The side of the incoming order 'Buy' or 'Sell'
+        """
+        self.buyer: str = buyer
+        self.seller: str = seller
+        self.price: int = price
+        self.units: int = units
+        self.aggressor: str = aggressor
+
+    def __repr__(self) -> str:
+        return f'Trade({self.buyer!r} from {self.seller!r}, {self.units} at {self.price})'
+
+
+"""
+Class to represent a price-time priority order book.
+"""
+class OrderBook:
+    def __init__(self) -> None:
+        """
+        :param bids:       Dictionary of price to queue of buy orders
+        :param asks:       Dictionary of price to queue of sell orders
+        :param bid_prices: Heap of the negated bid prices
+        :param ask_prices: Heap of the ask prices
+        :param orders:     Dictionary of order ID to open order
+        :param trades:     List of the fills in time order
+        """
+        self.bids: dict[int, deque[Order]] = {}
+        self.asks: dict[int, deque[Order]] = {}
+        self.bid_prices: list[int] = []
+        self.ask_prices: list[int] = []
+        self.orders: dict[int, Order] = {}
+        self.trades: list[Trade] = []
+        self.next_id: int = 1
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def best_bid(self) -> int:
+        """
+        :return: The highest price of an open buy order or None
+        """
+        while self.bid_prices:
+            price = -self.bid_prices[0]
+            if self._clear_level(self.bids, price):
+                return price
+            heapq.heappop(self.bid_prices)
+        return None
+
+    def best_ask(self) -> int:
+        """
+        :return: The lowest price of an open sell order or None
+        """
+        while self.ask_prices:
+            price = self.ask_prices[0]
+            if self._clear_level(self.asks, price):
+                return price
+            heapq.heappop(self.ask_prices)
+        return None
+
+    def _clear_level(self, book: dict[int, deque[Order]], price: int) -> bool:
+        """
+        Removes the cancelled orders from the front of a price level.
+        :return: True if the level has an open order, False if it was removed
+        """
+        level = book[price]
+        while level and not level[0].remaining:
+            level.popleft()
+        if level:
+            return True
+        del book[price]
+        return False
+
+    def depth(self, side: str, levels: int = 5) -> list[tuple[int, int]]:
+        """
+        Totals the open units of the best price levels of a side.
+        :param side:   'Buy' or 'Sell'
+        :param levels: The number of price levels
+        :return:       List of (price, units) from the best price
+        """
+        book = self.bids if side == 'Buy' else self.asks
+        prices = sorted(book, reverse=side == 'Buy')
+        depth = []
+        for price in prices:
+            units = sum(order.remaining for order in book[price])
+            if units:
+                depth.append((price, units))
+                if len(depth) == levels:
+                    break
+        return depth
+
+    def submit(self, trader: Trader, side: str, price: int, units: int) -> Order:
+        """
+        Matches an order against the other side of the book and rests the
+        units not filled.
+        :param trader: The trader placing the order
+        :param side:   'Buy' or 'Sell'
+        :param price:  The limit price
+        :param units:  The number of units
+        :return:       The order, with the units not filled remaining
+        """
+        order = Order(self.next_id, trader, side, price, units)
+        self.next_id += 1
+        # The bid heap is negated, so on both sides the levels which cross
+        # the limit price are those at the top of the heap <= sign * price
+        if side == 'Buy':
+            book, prices, sign = self.asks, self.ask_prices, 1
+        else:
+            book, prices, sign = self.bids, self.bid_prices, -1
+
+        # Match the best price levels which cross the limit price
+        while order.remaining and prices and prices[0] <= sign * price:
+            level_price = sign * prices[0]
+            level = book[level_price]
+            while level and order.remaining:
+                resting = level[0]
+                if not resting.remaining:
+                    level.popleft()
+                    continue
+                if resting.trader is trader:
+                    # Self-trade prevention cancels the resting order
+                    self.cancel(resting)
+                    level.popleft()
+                    continue
+                self._fill(order, resting, level_price)
+                if not resting.remaining:
+                    level.popleft()
+                    del self.orders[resting.order_id]
+            if not level:
+                del book[level_price]
+                heapq.heappop(prices)
+
+        if order.remaining:
+            self._rest(order)
+        return order
+
+    def _fill(self, order: Order, resting: Order, price: int) -> None:
+        units = min(order.remaining, resting.remaining)
+        order.remaining -= units
+        resting.remaining -= units
+        order.trader.fill(order.side, price, units)
+        resting.trader.fill(resting.side, price, units)
+        resting.trader.add_open(resting.side, resting.price, -units)
+        if order.side == 'Buy':
+            self.trades.append(Trade(order.trader.name, resting.trader.name, price, units, 'Buy'))
+        else:
+            self.trades.append(Trade(resting.trader.name, order.trader.name, price, units, 'Sell'))
+
+    def _rest(self, order: Order) -> None:
+        if order.side == 'Buy':
+            book, prices, key = self.bids, self.bid_prices, -order.price
+        else:
+            book, prices, key = self.asks, self.ask_prices, order.price
+        level = book.get(order.price)
+        if level is None:
+            level = book[order.price] = deque()
+            heapq.heappush(prices, key)
+        level.append(order)
+        self.orders[order.order_id] = order
+        order.trader.add_open(order.side, order.price, order.remaining)
+
+    def cancel(self, order: Order) -> bool:
+        """
+        Cancels the units not filled of an open order.
+        :return: Success (True) or Fail (False) if the order is not open
+        """
+        if self.orders.pop(order.order_id, None) is None:
+            return False
+        order.trader.add_open(order.side, order.price, -order.remaining)
+        order.remaining = 0
+        return True
+
+    def cancel_all(self) -> None:
+        for order in list(self.orders.values()):
+            self.cancel(order)
+
+
+"""
+Class to represent a round traded by many players through an order book.
+"""
+class Market:
+    def __init__(self, round: Round) -> None:
+        """
+        :param round:   The round traded, with its EV calculated
+        :param book:    The order book
+        :param traders: Dictionary of name to trader
+        :param maker:   The market maker, which has no balance limit
+        :param quotes:  The open market maker orders (bid, ask)
+        """
+        self.round: Round = round
+        self.book: OrderBook = OrderBook()
+        self.traders: dict[str, Trader] = {}
+        self.maker: Trader = Trader(MAKER, 0)
+        self.quotes: tuple[Order, ...] = ()
+
+    def join(self, name: str, balance: int = 500) -> Trader:
+        """
+        Adds a trader to the market.
+        :param name:    The unique name of the trader
+        :param balance: The start balance
+        :return:        The trader
+        """
+        if name in self.traders or name == MAKER:
+            raise ValueError(f'Trader {name} has already joined')
+        trader = self.traders[name] = Trader(name, balance)
+        return trader
+
+    def quote(self, config: 'QuoteConfig' = None) -> tuple:
+        """
+        Generates a spread for the round and replaces the market maker quote
+        in the book. The new quote is behind the players' orders at the same
+        price.
+        :param config: Quote from the value distribution with these settings, 
+                       skewed by the market maker position, instead of 
+                       Round.calculate_spread
+        :return:       Tuple (bid,ask) price
+        """
+        for order in self.quotes:
+            self.book.cancel(order)
+        if config is None:
+            bid, ask = self.round.calculate_spread()
+        else:
+            bid, ask = self.round.quote_spread(config, self.maker.position)
+        self.quotes = (self.book.submit(self.maker, 'Buy', bid, MAKER_UNITS),
+                       self.book.submit(self.maker, 'Sell', ask, MAKER_UNITS))
+        return bid, ask
+
+    def submit(self, name: str, side: str, units: int, price: int = None) -> Order:
+        """
+        Places an order of a trader.
+        :param name:  The name of the trader
+        :param side:  'Buy' or 'Sell'
+        :param units: The number of units
+        :param price: The limit price, the market maker quote if None
+        :return:      The order, or None if it is not valid which is limited
+                      by the trader balance
+        """
+        if side not in SIDES:
+            raise ValueError(f'Side must be one of {", ".join(SIDES)}')
+        if units <= 0:
+            return None
+        trader = self.traders[name]
+        if price is None:
+            price = self.round.spread[1] if side == 'Buy' else self.round.spread[0]
+        if not trader.can_afford(side, price, units, self.round.calculate_max_value()):
+            return None
+        return self.book.submit(trader, side, price, units)
+
+    def cancel(self, name: str, order_id: int) -> bool:
+        """
+        Cancels an open order of a trader.
+        :return: Success (True) or Fail (False) if the order is not open or
+                 is not of the trader
+        """
+        order = self.book.orders.get(order_id)
+        if order is None or order.trader.name != name:
+            return False
+        return self.book.cancel(order)
+
+    def settle(self) -> dict[str, int]:
+        """
+        Cancels the open orders, reveals all cards and settles every
+        position at the total value of the cards.
+        :return: Dictionary of trader name to profit/loss for the round,
+                 with the market maker
+        """
+        self.book.cancel_all()
+        self.quotes = ()
+        self.round.reveal_all_cards()
+        value = self.round.sum_value()
+        pls = {name: trader.settle(value) for name, trader in self.traders.items()}
+        pls[MAKER] = self.maker.settle(value)
+        return pls
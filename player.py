@@ -11,4 +11,103 @@ Class to represent a player in the market making card game.
 class Player:
     def __init__(self, balance = 500) -> None:
         self.balance = balance
-        
\ No newline at end of file
+
+
+"""
+Class to represent a player trading in an order book with other players.
+The position and cash are the net units and the net cash of the fills of
+the round, and the open buy and sell totals are of the orders resting in
+the book, so the worst case loss can be checked without walking the
+orders.
+"""
+class Trader(Player):
+    def __init__(self, name: str, balance = 500) -> None:
+        """
+        :param name:          The name of the trader
+        :param balance:       The balance at the start of the round
+        :param position:      Net units bought (positive) or sold (negative)
+        :param cash:          Net cash of the fills, negative when bought
+        :param buy_units:     Units of the open buy orders
+        :param buy_cost:      Cost of the open buy orders if filled
+        :param sell_units:    Units of the open sell orders
+        :param sell_proceeds: Proceeds of the open sell orders if filled
+        """
+        super().__init__(balance)
+        self.name: str = name
+        self.position: int = 0
+        self.cash: int = 0
+        self.buy_units: int = 0
+        self.buy_cost: int = 0
+        self.sell_units: int = 0
+        self.sell_proceeds: int = 0
+
+    def __repr__(self) -> str:
+        return f'Trader({self.name!r}, balance={self.balance}, position={self.position})'
+
+    def worst_loss(self, max_value: int) -> int:
+        """
+        Calculates the largest loss of the position if every open order on
+        the losing side fills. The loss is largest when the total value is
+        0 or the max value.
+        :param max_value: The max possible total value of the round
+        :return:          The worst case loss
+        """
+        # Total value 0: every buy fills and loses its cost
+        loss_low = self.buy_cost - self.cash
+        # Total value max: every sell fills and loses max value less its price
+        loss_high = ((self.sell_units - self.position) * max_value 
+                     - self.sell_proceeds - self.cash)
+        return max(loss_low, loss_high, 0)
+
+    def can_afford(self, side: str, price: int, units: int, max_value: int) -> bool:
+        """
+        Checks if an order is valid which is limited by the balance, as 
+        Round.check_order does, counting the position and the open orders.
+        :param side:      'Buy' or 'Sell'
+        :param price:     The limit price
+        :param units:     The number of units
+        :param max_value: The max possible total value of the round
+        :return:          Valid (True) or not valid (False)
+        """
+        self.add_open(side, price, units)
+        valid = self.worst_loss(max_value) <= self.balance
+        self.add_open(side, price, -units)
+        return valid
+
+    def add_open(self, side: str, price: int, units: int) -> None:
+        """
+        Adds units to the open orders, negative units remove them.
+        """
+        if side == 'Buy':
+            self.buy_units += units
+            self.buy_cost += price * units
+        else:
+            self.sell_units += units
+            self.sell_proceeds += price * units
+
+    def fill(self, side: str, price: int, units: int) -> None:
+        """
+        Adds a fill to the position.
+        """
+        if side == 'Buy':
+            self.position += units
+            self.cash -= price * units
+        else:
+            self.position -= units
+            self.cash += price * units
+
+    def settle(self, value: int) -> int:
+        """
+        Settles the position at the total value of the cards and starts the 
+        next round flat. The P/L is the sum of the P/L of each fill as 
+        Round.calculate_pl calculates it for one order.
+        :param value: The total value of the cards
+        :return:      The profit/loss for the round (negative values is loss)
+        """
+        pl = self.position * value + self.cash
+        self.balance += pl
+        self.position = 0
+        self.cash = 0
+        self.buy_units = self.buy_cost = 0
+        self.sell_units = self.sell_proceeds = 0
+        return pl
@@ -0,0 +1,296 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The recorder module streams a compact record of each finished round to an
+append-only log file and reads sessions back from the log.
+
+Two formats are supported:
+    jsonl   One JSON object per round
+    bin     A header followed by fixed-size little-endian binary records
+            which can be loaded as columns with load_columns
+"""
+import json
+import os
+import struct
+import uuid
+from typing import Iterator
+
+from deck import Card
+from round import Round
+
+FORMATS = ('jsonl', 'bin')
+
+ORDER_CODES = {None: 0, 'Pass': 0, 'Buy': 1, 'Sell': -1}
+ORDER_NAMES = {0: 'Pass', 1: 'Buy', -1: 'Sell'}
+
+BIN_MAGIC = b'MMCG'
+BIN_VERSION = 1
+BIN_HEADER = struct.Struct('<4sHH')  # magic, version, cards per round
+NO_CARD = 0xFFFF
+
+# Fields of a record in the order they are stored
+FIELDS = ('session', 'deck', 'round_num', 'cards', 'face_up', 'ev', 'bid', 'ask',
+          'order', 'units', 'total', 'input_pl', 'true_pl', 'start_bal', 'end_bal')
+
+
+def record_struct(cards_per_round: int) -> struct.Struct:
+    return struct.Struct(f'<QBI{cards_per_round}HQdiibIiqqqq')
+
+
+def record_dtype(cards_per_round: int):
+    """
+    NumPy dtype of a binary record, used to load a log as columns.
+    """
+    import numpy as np
+
+    return np.dtype([('session', '<u8'), ('deck', 'u1'), ('round_num', '<u4'),
+                     ('cards', '<u2', (cards_per_round,)), ('face_up', '<u8'),
+                     ('ev', '<f8'), ('bid', '<i4'), ('ask', '<i4'), ('order', 'i1'),
+                     ('units', '<u4'), ('total', '<i4'), ('input_pl', '<i8'),
+                     ('true_pl', '<i8'), ('start_bal', '<i8'), ('end_bal', '<i8')])
+
+
+"""
+Class to represent the record of a finished round.
+"""
+class RoundRecord:
+    __slots__ = FIELDS
+
+    def __init__(self, session=0, deck=0, round_num=0, cards=(), face_up=0, ev=0.0,
+                 bid=0, ask=0, order=0, units=0, total=0, input_pl=0, true_pl=0,
+                 start_bal=0, end_bal=0) -> None:
+        """
+        :param session:   The session ID
+        :param deck:      The deck configuration e.g. key of game.RANKS
+        :param round_num: The round number
+        :param cards:     Tuple of card IDs
+        :param face_up:   Bitmask of face-up cards, bit i is card i
+        :param ev:        The EV quoted on
+        :param bid:       The market maker bid
+        :param ask:       The market maker ask
+        :param order:     1 for buy, -1 for sell or 0 for pass
+        :param units:     The number of units of the order
+        :param total:     The total value of the cards
+        :param input_pl:  The profit/loss reported by the player
+        :param true_pl:   The actual profit/loss
+        :param start_bal: The player balance at the start of the round
+        :param end_bal:   The player balance at the end of the round
+        """
+        self.session: int = session
+        self.deck: int = deck
+        self.round_num: int = round_num
+        self.cards: tuple[int, ...] = tuple(cards)
+        self.face_up: int = face_up
+        self.ev: float = ev
+        self.bid: int = bid
+        self.ask: int = ask
+        self.order: int = order
+        self.units: int = units
+        self.total: int = total
+        self.input_pl: int = input_pl
+        self.true_pl: int = true_pl
+        self.start_bal: int = start_bal
+        self.end_bal: int = end_bal
+
+    @classmethod
+    def from_round(cls, round: Round, session: int = 0, deck: int = 0) -> 'RoundRecord':
+        return cls(session, deck, round.round_num, tuple(round.card_ids), round.face_up, round.ev,
+                   round.spread[0], round.spread[1], ORDER_CODES[round.order],
+                   round.order_unit, round.sum_value(), round.player_input_pl,
+                   round.player_true_pl, round.player_start_bal, round.player_end_bal)
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def is_face_up(self, idx: int) -> bool:
+        return bool(self.face_up >> idx & 1)
+
+    def describe(self, cards: tuple[Card, ...], face_down_sym: str = '--') -> str:
+        """
+        Returns the round summary in the same layout as Round.__str__.
+        :param cards: Table of every card in the deck indexed by card ID
+        """
+        show = ''.join(f'{str(cards[card_id]) if self.is_face_up(idx) else face_down_sym:<4}'
+                       for idx, card_id in enumerate(self.cards))
+        reveal = ''.join(f'{str(cards[card_id]):<4}' for card_id in self.cards)
+        order = ORDER_NAMES[self.order]
+        return (  f'Round:         {self.round_num}' + '\n'
+                + f'Cards:         {show} (EV = {self.ev:.2f})' + '\n'
+                + f'Reveal:        {reveal} (Actual = {self.total})' + '\n'
+                + f'Spread:        {self.bid} at {self.ask}' + '\n'
+                + f'Order:         {order} {self.units if self.units > 0 else ""}' + '\n'
+                + f'P/L reported:  {self.input_pl}' + '\n'
+                + f'P/L actual:    {self.true_pl}' + '\n'
+                + f'Start balance: {self.start_bal}' + '\n'
+                + f'End balance:   {self.end_bal}')
+
+
+"""
+Class to represent an append-only log of round records.
+"""
+class RoundRecorder:
+    def __init__(self, path: str, fmt: str = 'jsonl', cards_per_round: int = 3,
+                 fsync: bool = False, flush: bool = True) -> None:
+        """
+        :param path:            The log file path
+        :param fmt:             'jsonl' or 'bin'
+        :param cards_per_round: The max number of cards in a round, used by
+                                the binary format
+        :param fsync:           Force each record to disk (True) or leave it
+                                to the operating system once written (False)
+        :param flush:           Write each record to the file (True) or leave
+                                it in the file buffer until it is full or the
+                                log is closed (False)
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f'Round log format must be one of {", ".join(FORMATS)}')
+        self.path: str = path
+        self.fmt: str = fmt
+        self.cards_per_round: int = cards_per_round
+        self.fsync: bool = fsync
+        self.flush: bool = flush or fsync
+
+        if fmt == 'jsonl':
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            self.file = open(path, 'ab')
+            if self.file.tell() == 0:
+                self.file.write(BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, cards_per_round))
+            else:
+                self.cards_per_round = read_bin_header(path)
+                if self.cards_per_round < cards_per_round:
+                    raise ValueError(f'{path} holds at most {self.cards_per_round} '
+                                     'cards per round')
+            self.record_struct = record_struct(self.cards_per_round)
+
+    def __enter__(self) -> 'RoundRecorder':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, record: RoundRecord) -> None:
+        """
+        Appends a record to the log and flushes it unless flush is off.
+        """
+        if self.fmt == 'jsonl':
+            self.file.write(json.dumps(record.to_dict(), separators=(',', ':')) + '\n')
+        else:
+            cards = record.cards + (NO_CARD,) * (self.cards_per_round - len(record.cards))
+            self.file.write(self.record_struct.pack(
+                record.session, record.deck, record.round_num, *cards, record.face_up,
+                record.ev, record.bid, record.ask, record.order, record.units,
+                record.total, record.input_pl, record.true_pl, record.start_bal,
+                record.end_bal))
+        if self.flush:
+            self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def record(self, round: Round, session: int = 0, deck: int = 0) -> RoundRecord:
+        """
+        Appends the record of a finished round to the log.
+        :return: The record
+        """
+        record = RoundRecord.from_round(round, session, deck)
+        self.write(record)
+        return record
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_bin_header(path: str) -> int:
+    """
+    Reads the header of a binary log.
+    :return: The number of cards per round
+    """
+    with open(path, 'rb') as file:
+        magic, version, cards_per_round = BIN_HEADER.unpack(file.read(BIN_HEADER.size))
+    if magic != BIN_MAGIC or version != BIN_VERSION:
+        raise ValueError(f'{path} is not a round log')
+    return cards_per_round
+
+
+def new_session_id() -> int:
+    """
+    Creates a random session ID. Games sharing a log do not coordinate, so
+    the ID is 63 random bits of a UUID4, which do not repeat in practice.
+    """
+    return uuid.uuid4().int >> 65
+
+
+def log_format(path: str) -> str:
+    with open(path, 'rb') as file:
+        return 'bin' if file.read(len(BIN_MAGIC)) == BIN_MAGIC else 'jsonl'
+
+
+def read_records(path: str, session: int = None) -> Iterator[RoundRecord]:
+    """
+    Streams records from a log one at a time.
+    :param path:    The log file path
+    :param session: Only the records of this session if given
+    :return:        Iterator of records in the order they were written
+    """
+    if log_format(path) == 'jsonl':
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = RoundRecord(**json.loads(line))
+                if session is None or record.session == session:
+                    yield record
+        return
+
+    cards_per_round = read_bin_header(path)
+    layout = record_struct(cards_per_round)
+    with open(path, 'rb') as file:
+        file.seek(BIN_HEADER.size)
+        while True:
+            data = file.read(layout.size)
+            if len(data) < layout.size:
+                # A partly written record is left by a process which died
+                break
+            fields = layout.unpack(data)
+            cards = tuple(card_id for card_id in fields[3:3 + cards_per_round]
+                          if card_id != NO_CARD)
+            record = RoundRecord(*fields[:3], cards, *fields[3 + cards_per_round:])
+            if session is None or record.session == session:
+                yield record
+
+
+def load_columns(path: str, mmap: bool = False):
+    """
+    Loads a binary log as a NumPy structured array with one column per field.
+    :param path: The log file path
+    :param mmap: Memory-map the file (True) or read it into memory (False)
+    :return:     Structured array of records
+    """
+    import numpy as np
+
+    dtype = record_dtype(read_bin_header(path))
+    count = (os.path.getsize(path) - BIN_HEADER.size) // dtype.itemsize
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode='r', offset=BIN_HEADER.size, shape=(count,))
+    return np.fromfile(path, dtype=dtype, count=count, offset=BIN_HEADER.size)
+
+
+def print_summary(path: str, cards: tuple[Card, ...], session: int = None) -> None:
+    """
+    Prints the summary of each round of a session from a log.
+    :param path:    The log file path
+    :param cards:   Table of every card in the deck indexed by card ID
+    :param session: Only the rounds of this session if given
+    """
+    print_records(read_records(path, session), cards)
+
+
+def print_records(records: Iterator[RoundRecord], cards: tuple[Card, ...]) -> None:
+    """
+    Prints the summary of each of the records.
+    :param records: Iterable of records
+    :param cards:   Table of every card in the deck indexed by card ID
+    """
+    for record in records:
+        print(record.describe(cards), '\n')
@@ -0,0 +1,133 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The risk module calculates the distribution of the profit/loss of an order
+before it is placed, with its value at risk (VaR), expected shortfall (ES)
+and probability of ruin.
+
+The P/L of an order is the P/L of one unit times the number of units, and
+the P/L of one unit only depends on the total value of the cards. Every
+measure is calculated once for one unit from the distribution of total
+values and scaled to each number of units, so any number of order sizes
+are checked in a single vectorized call.
+"""
+import numpy as np
+
+SIDES = ('Buy', 'Sell')
+
+"""
+Class to represent the risk of an order for each of many numbers of units.
+"""
+class RiskReport:
+    def __init__(self, side: str, units: np.ndarray, unit_pl: np.ndarray,
+                 probs: np.ndarray, balance: int, confidence: float) -> None:
+        """
+        :param side:       'Buy' or 'Sell'
+        :param units:      Array of the numbers of units checked
+        :param unit_pl:    Array of each possible P/L of one unit from lowest
+        :param probs:      Array of the probability of each P/L of one unit
+        :param balance:    The player balance
+        :param confidence: Confidence level of VaR and ES e.g. 0.95
+        :param ev_pl:      Array of the expected P/L of each number of units
+        :param var:        Array of the VaR of each number of units, the loss
+                           which is only exceeded with 1 - confidence chance
+        :param es:         Array of the ES of each number of units, the mean
+                           loss in the worst 1 - confidence of outcomes
+        :param ruin:       Array of the probability the balance is zero or
+                           less after the round for each number of units
+        """
+        self.side: str = side
+        self.units: np.ndarray = units
+        self.unit_pl: np.ndarray = unit_pl
+        self.probs: np.ndarray = probs
+        self.balance: int = balance
+        self.confidence: float = confidence
+
+        tail = 1 - confidence
+        cdf = np.cumsum(probs)
+        # VaR of one unit is the P/L at the tail quantile
+        idx = min(int(np.searchsorted(cdf, tail - 1e-12)), len(unit_pl) - 1)
+        unit_var = -unit_pl[idx]
+        # ES of one unit is the mean of the tail, with part of the quantile
+        # outcome weighted in so the tail holds exactly 1 - confidence
+        below = cdf[idx - 1] if idx > 0 else 0.0
+        tail_sum = float((unit_pl[:idx] * probs[:idx]).sum()) + unit_pl[idx] * (tail - below)
+        unit_es = -tail_sum / tail if tail > 0 else unit_var
+
+        self.ev_pl: np.ndarray = float((unit_pl * probs).sum()) * units
+        self.var: np.ndarray = unit_var * units
+        self.es: np.ndarray = unit_es * units
+
+        # Ruin when units * P/L of one unit <= -balance
+        limits = np.floor_divide(-balance, np.maximum(units, 1))
+        self.ruin: np.ndarray = np.concatenate(([0.0], cdf))[
+            np.searchsorted(unit_pl, limits, side='right')]
+        self.ruin[units <= 0] = 0.0 if balance > 0 else 1.0
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def pl_distribution(self, idx: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the full P/L distribution of one of the numbers of units.
+        :param idx: Index into units
+        :return:    Tuple (P/L values from lowest, probabilities)
+        """
+        return self.unit_pl * self.units[idx], self.probs
+
+    def max_units(self, var_limit: float = None, es_limit: float = None,
+                  ruin_limit: float = None) -> int:
+        """
+        Returns the largest number of units checked which is within every
+        given limit.
+        :param var_limit:  Max VaR
+        :param es_limit:   Max ES
+        :param ruin_limit: Max probability of ruin
+        :return:           The number of units or 0 if none are within limits
+        """
+        within = np.ones(len(self.units), dtype=bool)
+        if var_limit is not None:
+            within &= self.var <= var_limit
+        if es_limit is not None:
+            within &= self.es <= es_limit
+        if ruin_limit is not None:
+            within &= self.ruin <= ruin_limit
+        return int(self.units[within].max(initial=0))
+
+    def to_dict(self) -> dict:
+        return {'side': self.side,
+                'confidence': self.confidence,
+                'units': self.units.tolist(),
+                'ev_pl': self.ev_pl.tolist(),
+                'var': self.var.tolist(),
+                'es': self.es.tolist(),
+                'ruin': self.ruin.tolist()}
+
+
+def order_risk(probs: np.ndarray, side: str, units, bid: int, ask: int, balance: int,
+               confidence: float = 0.95) -> RiskReport:
+    """
+    Calculates the risk of an order for each of many numbers of units.
+    :param probs:      Array where index is the total value and element is its
+                       probability e.g. from Round.calculate_value_distribution
+    :param side:       'Buy' or 'Sell'
+    :param units:      Number or sequence of numbers of units
+    :param bid:        The market maker bid
+    :param ask:        The market maker ask
+    :param balance:    The player balance
+    :param confidence: Confidence level of VaR and ES
+    :return:           The risk of each number of units
+    """
+    if side not in SIDES:
+        raise ValueError(f'Side must be one of {", ".join(SIDES)}')
+    if not 0 < confidence < 1:
+        raise ValueError('Confidence must be between 0 and 1')
+
+    totals = np.flatnonzero(probs)
+    unit_pl = totals - ask if side == 'Buy' else bid - totals
+    # Sort the P/L of one unit from lowest, selling reverses the totals
+    order = np.argsort(unit_pl, kind='stable')
+    units = np.atleast_1d(np.asarray(units, dtype=np.int64))
+    return RiskReport(side, units, unit_pl[order], np.asarray(probs)[totals][order],
+                      balance, confidence)
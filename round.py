@@ -4,32 +4,59 @@ Date: 05/04/24
 
 Market making card game
 """
-import copy
-from itertools import permutations
-import numpy as np
-import matplotlib.pyplot as plt
-import os
+from itertools import accumulate
+from typing import TYPE_CHECKING
 
 import random as rand
-from deck import Card, Deck
+from deck import Card, DeckSpec
+from instrumentation import timed
+from knowledge import KnowledgeState
 from market_event import MarketEvent
 
-DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+# NumPy and Matplotlib are imported by the methods which need them so that 
+# playing without charts does not pay for loading them.
+if TYPE_CHECKING:
+    from concurrent import futures
+
+    import numpy as np
+    from cache import StateCache
+    from charts import ChartRenderer
+    from distribution import DistributionEstimate
+    from quoting import QuoteConfig
+    from risk import RiskReport
 
 """
-Class to represent a round of the market making card game.
+Class to represent a round of the market making card game. The picked cards
+are stored as card IDs into the card table of the shared full deck and the
+face-up flags as a bitmask, bit i for picked card i. The picked cards which
+have been seen are a bitmask too, as cards dealt from a shoe of several
+decks can have the same card ID.
 """
 class Round:
-    def __init__(self, round_num=1, const_deck=None, picked_cards=[],
-                 is_face_up=[], card_values={}, seen_cards=set(), 
-                 market_events_enabled=False) -> None:
+    __slots__ = ('round_num', 'const_deck', 'card_values', 'card_ids', 'face_up',
+                 'seen_picked', 'seen_cards', 'knowledge', 'cache', 'rng', 'value_index',
+                 'distribution_estimate', 'ev', 'order', 'order_unit', 'spread',
+                 'player_start_bal', 'player_end_bal', 'player_true_pl', 'player_input_pl',
+                 'market_events_enabled', 'market_event')
+
+    def __init__(self, round_num=1, const_deck=None, picked_cards=None,
+                 is_face_up=None, card_values=None, seen_cards=None, 
+                 market_events_enabled=False, knowledge=None, cache=None,
+                 rng=None) -> None:
         self.round_num: int = round_num
-        self.const_deck: Deck = const_deck
-        self.card_values: dict[str, int] = card_values
-
-        self.picked_cards: list[Card] = picked_cards
-        self.is_face_up: list[bool] = is_face_up
-        self.seen_cards: set[Card] = seen_cards
+        self.const_deck: DeckSpec = const_deck
+        self.card_values: dict[str, int] = card_values if card_values is not None else {}
+
+        self.card_ids: list[int] = [card.card_id for card in picked_cards or ()]
+        self.face_up: int = 0
+        self.is_face_up = is_face_up if is_face_up is not None else ()
+        self.seen_picked: int = 0
+        self.seen_cards: set[int] = seen_cards if seen_cards is not None else set()
+        self.knowledge: KnowledgeState = knowledge
+        self.cache: StateCache = cache
+        self.rng: rand.Random = rng if rng is not None else rand
+        self.value_index: list[int] = None
+        self.distribution_estimate: DistributionEstimate = None
         self.ev: float = 0
 
         self.order = None
@@ -55,6 +82,53 @@ class Round:
                 + f'Start balance: {self.player_start_bal}' + '\n'
                 + f'End balance:   {self.player_end_bal}')
 
+    @property
+    def picked_cards(self) -> tuple[Card, ...]:
+        """
+        Tuple of the picked cards. The cards are stored as card IDs, so the 
+        tuple is read-only and cards are added with add_card.
+        """
+        cards = self.const_deck.cards
+        return tuple(cards[card_id] for card_id in self.card_ids)
+
+    @picked_cards.setter
+    def picked_cards(self, cards) -> None:
+        self.card_ids = [card.card_id for card in cards]
+        self.seen_picked = 0
+
+    @property
+    def is_face_up(self) -> tuple[bool, ...]:
+        """
+        Tuple of whether each picked card is face-up (True) or face-down 
+        (False). The flags are stored as a bitmask, so the tuple is read-only
+        and flags are changed by setting is_face_up or with reveal_next_card.
+        """
+        return tuple(bool(self.face_up >> idx & 1) for idx in range(len(self.card_ids)))
+
+    @is_face_up.setter
+    def is_face_up(self, flags) -> None:
+        self.face_up = 0
+        for idx, is_face_up in enumerate(flags):
+            if is_face_up:
+                self.face_up |= 1 << idx
+
+    def is_card_face_up(self, idx: int) -> bool:
+        return bool(self.face_up >> idx & 1)
+
+    def snapshot(self) -> 'Round':
+        """
+        Copies the state of the round. State shared by every round of a game 
+        e.g. the deck, card values, seen cards and knowledge is shared by the 
+        copy rather than copied, and the max value index is rebuilt on demand.
+        :return: The copy
+        """
+        copy = Round.__new__(Round)
+        for name in Round.__slots__:
+            setattr(copy, name, getattr(self, name))
+        copy.card_ids = list(self.card_ids)
+        copy.value_index = None
+        return copy
+
     def show_round(self, face_down_sym: str = '--') -> str:
         """
         Returns a string of the round for the player.
@@ -62,10 +136,11 @@ class Round:
         :return: String of cards. By default, -- if the card is face-down.
         """
         show = []
-        for card, is_face_up in zip(self.picked_cards, self.is_face_up):
-            if is_face_up:
-                show.append(f'{str(card):<4}')
-                self.seen_cards.add(card.card_id)
+        cards = self.const_deck.cards
+        for idx, card_id in enumerate(self.card_ids):
+            if self.face_up >> idx & 1:
+                show.append(f'{str(cards[card_id]):<4}')
+                self.see_picked(idx)
             else:
                 show.append(f'{face_down_sym:<4}')
         return ''.join(show)
@@ -76,107 +151,208 @@ class Round:
         :return: String of all cards.
         """
         reveal = []
-        for card in self.picked_cards:
-            self.seen_cards.add(card.card_id)
-            reveal.append(f'{str(card):<4}')
+        cards = self.const_deck.cards
+        for idx, card_id in enumerate(self.card_ids):
+            self.see_picked(idx)
+            reveal.append(f'{str(cards[card_id]):<4}')
         return ''.join(reveal)
 
+    def see_picked(self, idx: int) -> None:
+        """
+        Marks a picked card as seen the first time it is shown.
+        :param idx: Index of the picked card
+        """
+        if not self.seen_picked >> idx & 1:
+            self.seen_picked |= 1 << idx
+            self.see_card(self.const_deck.cards[self.card_ids[idx]])
+
+    def see_card(self, card: Card) -> None:
+        """
+        Marks a card as seen.
+        :param card: The card which has been seen.
+        """
+        is_new = card.card_id not in self.seen_cards
+        self.seen_cards.add(card.card_id)
+        if self.knowledge:
+            is_new = self.knowledge.reveal(card.card_id)
+        if is_new:
+            self.value_index = None
+
+    def face_down_count(self) -> int:
+        """
+        Returns the number of face-down cards in the round.
+        """
+        return len(self.card_ids) - self.face_up.bit_count()
+
+    def reveal_next_card(self) -> Card:
+        """
+        Turns the first face-down card face-up.
+        :return: The revealed card or None if all cards are face-up.
+        """
+        for idx, card_id in enumerate(self.card_ids):
+            if not self.face_up >> idx & 1:
+                self.face_up |= 1 << idx
+                self.see_picked(idx)
+                return self.const_deck.cards[card_id]
+        return None
+
+    @timed('rand_face_up')
     def rand_face_up(self) -> None:
         """
         Randomly assigns cards in a round to be face-up (True) or face-down (False).
         """
-        face_up = []
-        face_up_limit = len(self.picked_cards) // 3
+        face_up = 0
+        face_up_limit = len(self.card_ids) // 3
         face_up_chance = 0.5
 
-        for idx in range(len(self.picked_cards)):
-            if idx < face_up_limit:
-                roll = rand.randint(1, 100) / 100
-                if roll <= face_up_chance:
-                    face_up.append(True)
-                else:
-                    face_up.append(False)
-            else:
-                face_up.append(False)
-        self.is_face_up = face_up
+        for idx in range(face_up_limit):
+            roll = self.rng.randint(1, 100) / 100
+            if roll <= face_up_chance:
+                face_up |= 1 << idx
+        self.face_up = face_up
+
+    def state_key(self) -> tuple:
+        """
+        Creates the canonical key of what is known in the round, used to cache 
+        calculations which only depend on it.
+        :return: Tuple (deck signature, unseen value signature, face-up sum, 
+                 face-down count)
+        """
+        from cache import state_key, value_signature
+
+        if self.knowledge:
+            deck_signature = self.knowledge.deck_signature
+        else:
+            deck_signature = value_signature(self.const_deck.value_counts(self.card_values))
+        return state_key(deck_signature, self.count_unseen_values(), self.sum_face_up(),
+                         self.face_down_count())
+
+    def cached(self, kind: str, calculate):
+        """
+        Returns a calculation from the cache if the round has one.
+        :param kind:      The name of the calculation
+        :param calculate: Callable returning the value on a cache miss
+        :return:          The value
+        """
+        if self.cache is None:
+            return calculate()
+        return self.cache.get_or_calculate((kind, *self.state_key()), calculate)
 
+    @timed('calculate_ev')
     def calculate_ev(self) -> float:
         """
-        Calculates the EV given any revealed cards. 
+        Calculates the EV given any revealed cards. The EV from the knowledge
+        state is O(1), cheaper than the cache key, so only the EV of a 
+        market event or of a round without knowledge is cached.
         :return: The EV given any revealed cards.
         """
-        # Calculate sum of values for any cards which have not been seen.
-        value_sum = 0
-        for card in self.const_deck.deck:
-            card: Card
-            if card.card_id not in self.seen_cards:
-                value_sum += self.card_values[card.rank]
+        if self.knowledge and self.market_event is None:
+            self.ev = self.compute_ev()
+        else:
+            self.ev = self.cached('ev', self.compute_ev)
+        return self.ev
 
-        # Calculate EV of which have not been seen.
-        total_cards = len(self.const_deck.ranks) * len(self.const_deck.suits)
-        ev_unseen = value_sum / (total_cards - len(self.seen_cards))
+    def compute_ev(self) -> float:
+        """
+        Calculates the EV without the cache.
+        """
+        if self.knowledge and self.market_event is None:
+            ev_unseen = self.knowledge.ev_unseen()
+        else:
+            # Calculate EV of the cards which have not been seen.
+            counts = self.count_unseen_values()
+            unseen = sum(counts.values())
+            ev_unseen = (sum(value * count for value, count in counts.items()) / unseen
+                         if unseen else 0)
 
-        ev = 0
-        for card, is_face_up in zip(self.picked_cards, self.is_face_up):
-            if is_face_up:
-                ev += self.card_values[card.rank]
-            else:
-                ev += ev_unseen
-        self.ev = ev
-        return ev
+        return self.sum_face_up() + ev_unseen * self.face_down_count()
+
+    def build_value_index(self) -> list[int]:
+        """
+        Builds the index of the highest values of unseen cards. Element k is 
+        the sum of the k highest values so the max value of any number of 
+        face-down cards is a single lookup. Only as many values as there are
+        picked cards are indexed, so the cost scales with the number of 
+        distinct values rather than the number of unseen cards. The index is
+        rebuilt after any new card is seen.
+        :return: List of prefix sums of unseen values sorted from highest
+        """
+        count = len(self.card_ids)
+        if self.knowledge and self.market_event is None:
+            unseen_values = self.knowledge.top_values(count)
+        else:
+            unseen_values = []
+            for value, copies in sorted(self.count_unseen_values().items(), reverse=True):
+                if len(unseen_values) >= count:
+                    break
+                unseen_values.extend([value] * min(copies, count - len(unseen_values)))
+        self.value_index = list(accumulate(unseen_values, initial=0))
+        return self.value_index
 
     def calculate_max_value(self) -> int:
         """
         Calculates the max possible total value given any revealed cards. 
         Used to check if short positions will exceed the current balance.
+        Cached like calculate_ev.
         :return: The max total value given any revealed cards.
         """
-        # Sort deck by value
-        sort_deck: list[Card] = sorted(self.const_deck.deck,
-                                       key=lambda card: self.card_values[card.rank])
-        # Remove any seen cards
-        for card in sort_deck:
-            card: Card
-            if card.card_id in self.seen_cards:
-                sort_deck.remove(card)
+        if self.knowledge and self.market_event is None:
+            return self.compute_max_value()
+        return self.cached('max_value', self.compute_max_value)
+
+    def compute_max_value(self) -> int:
+        """
+        Calculates the max possible total value without the cache.
+        """
+        if self.value_index is None:
+            self.build_value_index()
 
         # Calculate max value picking from the highest value card then 
         # 2nd highest, 3rd highest etc.
-        max_val = 0
-        idx = -1
-        for card, is_face_up in zip(self.picked_cards, self.is_face_up):
-            if is_face_up:
-                max_val += self.card_values[card.rank]
-            else:
-                max_val += self.card_values[sort_deck[idx].rank]
-                idx -= 1
-
-        return max_val
+        return self.sum_face_up() + self.value_index[self.face_down_count()]
 
     def sum_value(self) -> int:
         """
         Calculates the total value of the cards including unrevealed cards.
         :return: The total value of the cards
         """
+        cards = self.const_deck.cards
         total = 0
-        for card in self.picked_cards:
-            total += self.card_values[card.rank]
+        for card_id in self.card_ids:
+            total += self.card_values[cards[card_id].rank]
         return total
 
+    @timed('calculate_spread')
     def calculate_spread(self) -> tuple:
         """
         Generates a spread for the round given the EV of the current round.
         :return: Tuple (bid,ask) price
         """
         offset_limit = int(self.ev / 5)
-        offset = rand.randint(-offset_limit, offset_limit)
+        offset = self.rng.randint(-offset_limit, offset_limit)
 
-        spread_width = rand.randint(2, 6)
+        spread_width = self.rng.randint(2, 6)
         spread_bid = self.ev + offset - spread_width // 2
         spread_ask = self.ev + offset + spread_width // 2
         self.spread = int(spread_bid), int(spread_ask)
         return self.spread
 
+    @timed('quote_spread')
+    def quote_spread(self, config: 'QuoteConfig' = None, inventory: int = 0) -> tuple:
+        """
+        Generates a spread for the round from the quantiles and variance of 
+        the distribution of values, see quoting.quote.
+        :param config:    The quoting settings, quoting.DEFAULT_CONFIG if None
+        :param inventory: Market maker inventory the quote is skewed by
+        :return:          Tuple (bid,ask) price
+        """
+        from quoting import DEFAULT_CONFIG, quote
+
+        self.spread = quote(self.calculate_value_distribution(chart=False), inventory,
+                            config or DEFAULT_CONFIG)
+        return self.spread
+
+    @timed('calculate_pl')
     def calculate_pl(self) -> int:
         """
         Calculates the profit/loss for the round given the player's 
@@ -192,53 +368,116 @@ class Round:
         self.player_true_pl = pl
         return self.player_true_pl
 
-    def calculate_value_distribution(self) -> None:
+    def sum_face_up(self) -> int:
+        """
+        Calculates the total value of the face-up cards.
+        """
+        cards = self.const_deck.cards
+        sum_face_up = 0
+        for idx, card_id in enumerate(self.card_ids):
+            if self.face_up >> idx & 1:
+                sum_face_up += self.card_values[cards[card_id].rank]
+        return sum_face_up
+
+    def count_unseen_values(self) -> dict[int, int]:
+        """
+        Counts how many unseen cards there are of each card value. With a 
+        market event only cards which can be dealt are counted, valued with 
+        the event.
+        :return: Mapping of value to number of unseen cards
+        """
+        if self.knowledge:
+            counts = {value: count for value, count in self.knowledge.value_counts.items()
+                      if count > 0}
+        else:
+            from distribution import unseen_value_counts
+
+            card_values = (self.market_event.card_values if self.market_event 
+                           else self.card_values)
+            counts = unseen_value_counts(self.const_deck.deck, card_values, self.seen_cards)
+        if self.market_event:
+            counts = self.market_event.transform_counts(
+                counts, self.seen_cards, self.knowledge.card_counts if self.knowledge else None)
+        return counts
+
+    @timed('calculate_value_distribution')
+    def calculate_value_distribution(self, chart: bool = True,
+                                     renderer: 'ChartRenderer' = None,
+                                     approximate: bool = False,
+                                     executor: 'futures.Executor' = None,
+                                     tasks: int = None) -> 'np.ndarray':
         """
         Generates the distribution of values given any revealed cards and saves 
         the histogram to file.
+        :param chart:       Save the histogram to file (True) or not (False)
+        :param renderer:    Background renderer the histogram is queued on. The 
+                            histogram is saved before returning if None.
+        :param approximate: Estimate the distribution by sampling (True) or 
+                            calculate it exactly (False)
+        :param executor:    Process pool the sampling is split across when 
+                            approximate, sampled in this process if None
+        :param tasks:       The number of sampling tasks per batch, the 
+                            number of workers of the executor if None
+        :return:            Array of the probability of each total value
         """
-        # Sum face_up cards
-        sum_face_up = 0
-        for card, is_face_up in zip(self.picked_cards, self.is_face_up):
-            if is_face_up:
-                sum_face_up += self.card_values[card.rank]
-
-        # Remove any seen cards
-        not_seen = list(copy.deepcopy(self.const_deck.deck))
-        for card in not_seen:
-            card: Card
-            if card.card_id in self.seen_cards:
-                not_seen.remove(card)
-        
-        # Get permutations
-        face_down = len(self.picked_cards) - sum(self.is_face_up)
-        perms = permutations(not_seen, face_down)
-
-        # Frequency of values
-        frequency = []
-        for card_perm in perms:
-            val = 0
-            for card in card_perm:
-                val += self.card_values[card.rank]
-            val += sum_face_up
-            frequency.append(val)
-        
-        # Plot and save
-        _path = f'{DIR_PATH}/charts/round_{self.round_num}_histogram.png'
-        num_bins = len(set(frequency))
-        fig, ax = plt.subplots()
-        ax.hist(frequency, num_bins, density=True)
-        ax.set_xlabel('Value')
-        ax.set_xlim(xmin=0, xmax=50)
-        ax.set_ylabel('Probability Density')
-        ax.set_ylim(ymax=0.1)
-        ax.set_title(f'Card Value Sum Probability Density - Round {self.round_num}')
-        fig.tight_layout()
-        try:
-            plt.savefig(_path, bbox_inches="tight")
-        except FileNotFoundError:
-            pass
+        if approximate:
+            probs = self.estimate_value_distribution(executor=executor, tasks=tasks).probs
+        else:
+            probs = self.cached('value_distribution', self.compute_value_distribution)
 
+        if chart and renderer:
+            renderer.submit(self.round_num, probs)
+        elif chart:
+            self.save_value_distribution_chart(probs)
+        return probs
+
+    def compute_value_distribution(self) -> 'np.ndarray':
+        """
+        Calculates the exact probability of each total value of any cards which 
+        have not been seen without the cache.
+        :return: Read-only array of the probability of each total value
+        """
+        from distribution import sum_distribution
+
+        probs = sum_distribution(self.count_unseen_values(), self.face_down_count(),
+                                 offset=self.sum_face_up())
+        probs.flags.writeable = False
+        return probs
+
+    @timed('estimate_value_distribution')
+    def estimate_value_distribution(self, **sampling) -> 'DistributionEstimate':
+        """
+        Estimates the distribution of values given any revealed cards by 
+        sampling the face-down cards from the unseen cards.
+        :param sampling: Options of distribution.sample_distribution e.g. 
+                         precision, time_budget, executor or seed
+        :return:         The estimate with confidence intervals of the EV and 
+                         tail quantiles
+        """
+        from distribution import sample_distribution
+        from streams import RandomStream
+
+        # Sampling is seeded from a stream spawned from the round stream, so
+        # it can be replayed without drawing from the stream cards are dealt
+        # from. A round without a stream samples with a fresh seed.
+        if 'seed' not in sampling and isinstance(self.rng, RandomStream):
+            sampling['seed'] = self.rng.spawn('sampling', self.round_num,
+                                              self.face_down_count()).numpy_seed()
+        self.distribution_estimate = sample_distribution(
+            self.count_unseen_values(), self.face_down_count(), offset=self.sum_face_up(),
+            **sampling)
+        return self.distribution_estimate
+
+    def save_value_distribution_chart(self, probs: 'np.ndarray') -> None:
+        """
+        Saves the histogram of the distribution of values to file.
+        :param probs: Array of the probability of each total value
+        """
+        import charts
+
+        charts.save_chart(charts.chart_path(self.round_num), self.round_num, probs)
+
+    @timed('check_order')
     def check_order(self, order: str, units: int) -> bool:
         """
         Checks if an order is valid which is limited by the player balance.
@@ -257,6 +496,43 @@ class Round:
                 return True
         return False
 
+    @timed('check_order')
+    def check_orders(self, orders, units) -> 'np.ndarray':
+        """
+        Checks if each of a batch of orders is valid which is limited by the 
+        player balance.
+        :param orders: Sequence of order types 'Buy' or 'Sell'
+        :param units:  Sequence of the number of units for each order
+        :return:       Array of valid (True) or not valid (False)
+        """
+        import numpy as np
+
+        orders = np.asarray(orders)
+        units = np.asarray(units)
+        # Check if valid long positions
+        is_long = (orders == 'Buy') & (self.spread[1] * units <= self.player_start_bal)
+        # Check if valid short positions
+        is_short = ((orders == 'Sell') 
+                    & ((self.calculate_max_value() - self.spread[0]) * units 
+                       <= self.player_start_bal))
+        return is_long | is_short
+
+    @timed('check_risk')
+    def check_risk(self, order: str, units, confidence: float = 0.95) -> 'RiskReport':
+        """
+        Calculates the distribution of the profit/loss of an order before it 
+        is placed given the current spread and the unseen cards, with its 
+        VaR, expected shortfall and probability of ruin.
+        :param order:      The order type 'Buy' or 'Sell'
+        :param units:      Number or sequence of numbers of units to check
+        :param confidence: Confidence level of VaR and expected shortfall
+        :return:           The risk of each number of units
+        """
+        from risk import order_risk
+
+        return order_risk(self.calculate_value_distribution(chart=False), order, units,
+                          self.spread[0], self.spread[1], self.player_start_bal, confidence)
+
     def place_order(self, order: str, units: int) -> bool:
         """
         Places an order.
@@ -278,20 +554,36 @@ class Round:
         Adds a card to the round in face-down by default.
         :param card: The card to be added.
         """
-        self.picked_cards.append(card)
-        self.is_face_up.append(False)
+        self.card_ids.append(card.card_id)
 
     def clear_cards(self) -> None:
         """
         Clears the cards and card states for the round.
         """
-        self.picked_cards.clear()
-        self.is_face_up.clear()
-
-    def roll_market_event(self) -> int:
-        if self.market_events_enabled:
-            event = MarketEvent()
+        self.card_ids.clear()
+        self.face_up = 0
+        self.seen_picked = 0
 
-        else:
+    def roll_market_event(self, event_chance: float = 0.5) -> int:
+        """
+        Rolls for a random market event for the round.
+        :param event_chance: The chance of an event
+        :return:             The event ID, 0 for no event
+        """
+        if not self.market_events_enabled:
             return 0
-        
\ No newline at end of file
+        event = MarketEvent(event_chance=event_chance, deck=self.const_deck,
+                            card_values=self.card_values, rng=self.rng)
+        if event.random_event():
+            self.set_market_event(event)
+        return event.event_id
+
+    def set_market_event(self, event: MarketEvent) -> None:
+        """
+        Sets the market event of the round. Cards are valued with the event 
+        from then on.
+        :param event: The compiled market event
+        """
+        self.market_event = event
+        self.card_values = event.event_values
+        self.value_index = None
@@ -0,0 +1,256 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The server module hosts many independent sessions of the market making card
+game over a local TCP socket with asyncio.
+
+Each line sent by the server is a message or a prompt. The client answers
+each prompt with one line. Each turn to place an order is limited to
+game.TIME_LIMIT seconds.
+
+Prompts carry a sequence number which increases with each prompt of the
+session. The client should start its answer with the sequence number of
+the prompt, e.g. '7 B,10'. An answer with the number of an earlier prompt,
+such as one sent just after a TIMEOUT, is ignored rather than taken as the
+answer to the next prompt. An answer without a number is taken as the
+answer to the current prompt.
+    ROUND <round>                   Start of a round
+    EVENT <description>             Market event this round, if any
+    CARDS <card> <card> ...         Cards this round, -- if face-down
+    QUOTE <bid> <ask>               Market maker quote
+    BALANCE <balance>               Player balance
+    ORDER <seq>                     Prompt for an order e.g. B,10 or S,5 or P
+    ERROR <message>                 The last answer was rejected
+    TIMEOUT                         The turn ran out of time and the order 
+                                    was passed
+    REVEAL <card> <card> ...        All cards this round
+    PL <seq>                        Prompt for the reported profit/loss
+    RESULT <actual P/L> <balance>   Actual profit/loss and the new balance
+    END <balance>                   End of the session
+"""
+import argparse
+import asyncio
+
+import game
+import validation
+from cache import shared_cache
+from deck import DeckSpec
+from instrumentation import instruments
+from player import Player
+from round import Round
+from streams import RandomStream
+
+HOST = '127.0.0.1'
+PORT = 8765
+BACKLOG = 1024
+
+"""
+Class to represent a game server hosting many sessions.
+"""
+class GameServer:
+    def __init__(self, spec: DeckSpec, host: str = HOST, port: int = PORT,
+                 seed: int = None) -> None:
+        """
+        :param spec: The compiled deck shared by every session
+        :param host: The host to listen on
+        :param port: The port to listen on, 0 for any free port
+        :param seed: Root seed of the sessions, session n plays with the 
+                     stream 'session/n'. Random if None.
+        """
+        self.spec: DeckSpec = spec
+        self.host: str = host
+        self.port: int = port
+        self.rng: RandomStream = RandomStream(seed)
+
+        self.sessions_started: int = 0
+        self.sessions_active: int = 0
+        self.sessions_completed: int = 0
+        self.server: asyncio.base_events.Server = None
+
+    async def start(self) -> None:
+        """
+        Starts listening for sessions.
+        """
+        self.server = await asyncio.start_server(self.handle_session, self.host, self.port,
+                                                 backlog=BACKLOG)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_session(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+        """
+        Plays one game with the connected client.
+        """
+        self.sessions_started += 1
+        self.sessions_active += 1
+        rng = self.rng.spawn('session', self.sessions_started)
+        try:
+            if await play_session(reader, writer, self.spec, rng):
+                self.sessions_completed += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.sessions_active -= 1
+            writer.close()
+
+
+async def send(writer: asyncio.StreamWriter, *lines: str) -> None:
+    writer.write(''.join(f'{line}\n' for line in lines).encode())
+    await writer.drain()
+
+
+async def prompt(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 tag: str, seq: int, timeout: float = None) -> str:
+    """
+    Sends a prompt and waits for the answer.
+    :param seq:     The sequence number of the prompt
+    :param timeout: Seconds to wait, no limit if None
+    :return:        The answer or None if the client disconnected
+    :raises asyncio.TimeoutError: The answer did not arrive in time
+    """
+    await send(writer, f'{tag} {seq}')
+    return await asyncio.wait_for(read_answer(reader, seq), timeout)
+
+
+async def read_answer(reader: asyncio.StreamReader, seq: int) -> str:
+    """
+    Reads lines until the answer to a prompt, skipping answers to earlier 
+    prompts.
+    :param seq: The sequence number of the prompt
+    :return:    The answer without its sequence number or None if the client
+                disconnected
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        answer = line.decode().strip()
+        answer_seq, _, rest = answer.partition(' ')
+        if not answer_seq.isdigit() or not rest:
+            return answer
+        if int(answer_seq) == seq:
+            return rest.strip()
+
+
+def show_cards(round: Round) -> str:
+    return ' '.join(round.show_round().split())
+
+
+async def play_session(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       spec: DeckSpec, rng: RandomStream = None) -> bool:
+    """
+    Plays a game following the rules of game.main.
+    :param rng: Random number generator of the session
+    :return:    True if the game was played to the end
+    """
+    game_deck, knowledge = game.new_game_deck(spec, rng)
+    player = Player(game.START_BALANCE)
+    seen_cards = set()
+
+    loop = asyncio.get_running_loop()
+    seq = 0  # Sequence number of the last prompt
+    curr_round = 1
+    while curr_round <= game.ROUNDS and len(game_deck) > 0:
+        with instruments.timer('quote'):
+            round = game.deal_round(curr_round, game_deck, spec, knowledge, seen_cards,
+                                    shared_cache if game.CACHE else None, rng=rng)
+            round.calculate_ev()
+            bid, ask = round.calculate_spread()
+        round.player_start_bal = player.balance
+        event = [f'EVENT {round.market_event}'] if round.market_event else []
+        await send(writer, f'ROUND {curr_round}', *event, f'CARDS {show_cards(round)}',
+                   f'QUOTE {bid} {ask}', f'BALANCE {player.balance}')
+
+        # Player trades until the turn runs out of time
+        turn_start = loop.time()
+        while True:
+            timeout = (turn_start + game.TIME_LIMIT - loop.time()) if game.TIME_LIMIT else None
+            try:
+                if timeout is not None and timeout <= 0:
+                    raise asyncio.TimeoutError
+                seq += 1
+                user_in = await prompt(reader, writer, 'ORDER', seq, timeout)
+            except asyncio.TimeoutError:
+                await send(writer, 'TIMEOUT')
+                round.place_order('Pass', 0)
+                break
+            if user_in is None:
+                return False
+            order = validation.parse_order(user_in)
+            if order is None or (order[0] == 'Next' and not game.STAGED_REVEALS):
+                await send(writer, 'ERROR Invalid input')
+                continue
+
+            action, units = order
+            if action == 'Next':
+                if round.face_down_count() > 1:
+                    round.reveal_next_card()
+                    round.calculate_ev()
+                    bid, ask = round.calculate_spread()
+                    await send(writer, f'CARDS {show_cards(round)}', f'QUOTE {bid} {ask}')
+                else:
+                    await send(writer, 'ERROR No more cards are revealed this round')
+                continue
+            if round.place_order(action, units):
+                break
+            await send(writer, 'ERROR Long position exceeds balance' if action == 'Buy'
+                       else 'ERROR Short position exceeds balance')
+        if instruments.enabled:
+            instruments.observe('player_decision', loop.time() - turn_start)
+
+        await send(writer, f'REVEAL {" ".join(round.reveal_all_cards().split())}')
+
+        # Player reports P/L
+        if round.order != 'Pass':
+            while True:
+                seq += 1
+                user_in = await prompt(reader, writer, 'PL', seq)
+                if user_in is None:
+                    return False
+                pl = validation.parse_pl(user_in)
+                if pl is not None:
+                    round.player_input_pl = pl
+                    break
+                await send(writer, 'ERROR Invalid input')
+
+        round.calculate_pl()
+        player.balance += round.player_true_pl
+        round.player_end_bal = player.balance
+        await send(writer, f'RESULT {round.player_true_pl} {player.balance}')
+        curr_round += 1
+
+    await send(writer, f'END {player.balance}')
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Host market making card game sessions')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--deck', type=int, default=1, choices=sorted(game.RANKS))
+    parser.add_argument('--deck-config', default=None,
+                        help='JSON or TOML deck configuration file, instead of --deck')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    spec = game.get_deck_spec(args.deck_config if args.deck_config else args.deck)
+    server = GameServer(spec, args.host, args.port, args.seed)
+    print(f'Serving on {args.host}:{args.port} (seed {server.rng.root_seed})')
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The simulation module plays batches of headless rounds of the market making
+card game with NumPy arrays. Each round in a batch is dealt from its own
+freshly shuffled deck and follows the same rules as Round.rand_face_up,
+Round.calculate_ev, Round.calculate_spread, Round.check_order and
+Round.calculate_pl. The market maker can instead quote from the value
+distribution of each round as Round.quote_spread does.
+"""
+import argparse
+import time
+from collections import Counter
+
+import numpy as np
+
+from cache import StateCache, state_key, value_signature
+from distribution import sum_distribution
+from quoting import QuoteConfig, quote_batch, stack_distributions
+
+BUY = 1
+SELL = -1
+PASS = 0
+
+# Max number of distributions kept between the chunks of a simulation
+QUOTE_CACHE_SIZE = 1 << 16
+
+
+def card_value_table(ranks: list[str], suits: list[str],
+                     card_values: dict[str, int]) -> np.ndarray:
+    """
+    Creates the value of each card ID in the same order as Deck.create_deck.
+    :param ranks:       The list of ranks
+    :param suits:       The list of suits
+    :param card_values: Mapping of rank to value
+    :return:            Array where index is the card ID and element is the value
+    """
+    return np.repeat(np.array([card_values[rank] for rank in ranks]), len(suits))
+
+
+def ev_policy(batch: 'SimulationBatch') -> tuple[np.ndarray, np.ndarray]:
+    """
+    Buys one unit when the EV is above the ask, sells one unit when the EV is
+    below the bid and passes otherwise.
+    :param batch: The batch of rounds after the market maker quotes
+    :return:      Tuple (side, units) arrays
+    """
+    side = np.where(batch.ev > batch.ask, BUY,
+                    np.where(batch.ev < batch.bid, SELL, PASS))
+    units = np.where(side != PASS, 1, 0)
+    return side, units
+
+
+"""
+Class to represent a batch of simulated rounds.
+"""
+class SimulationBatch:
+    def __init__(self, cards: np.ndarray, values: np.ndarray,
+                 is_face_up: np.ndarray) -> None:
+        """
+        :param cards:      (rounds, cards per round) array of card IDs
+        :param values:     (rounds, cards per round) array of card values
+        :param is_face_up: (rounds, cards per round) face-up mask
+        """
+        self.cards: np.ndarray = cards
+        self.values: np.ndarray = values
+        self.is_face_up: np.ndarray = is_face_up
+
+        self.ev: np.ndarray = None
+        self.max_value: np.ndarray = None
+        self.bid: np.ndarray = None
+        self.ask: np.ndarray = None
+
+        self.side: np.ndarray = None
+        self.units: np.ndarray = None
+        self.is_valid: np.ndarray = None
+        self.pl: np.ndarray = None
+
+        self.elapsed: float = 0
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    @property
+    def sum_value(self) -> np.ndarray:
+        return self.values.sum(axis=1)
+
+    @property
+    def rounds_per_second(self) -> float:
+        return len(self) / self.elapsed if self.elapsed > 0 else float('inf')
+
+
+def deal(rng: np.random.Generator, rounds: int, deck_size: int,
+         cards_per_round: int) -> np.ndarray:
+    """
+    Deals the top cards of an independently shuffled deck for every round.
+    :param rng:             The random number generator
+    :param rounds:          The number of rounds
+    :param deck_size:       The number of cards in the deck
+    :param cards_per_round: The number of cards dealt each round
+    :return:                (rounds, cards per round) array of card IDs
+    """
+    keys = rng.random((rounds, deck_size))
+    return np.argpartition(keys, cards_per_round - 1, axis=1)[:, :cards_per_round]
+
+
+def rand_face_up(rng: np.random.Generator, rounds: int,
+                 cards_per_round: int, face_up_chance: float = 0.5) -> np.ndarray:
+    """
+    Randomly turns face-up each of the first third of the cards of a round.
+    :return: (rounds, cards per round) face-up mask
+    """
+    is_face_up = np.zeros((rounds, cards_per_round), dtype=bool)
+    face_up_limit = cards_per_round // 3
+    rolls = rng.integers(1, 101, size=(rounds, face_up_limit)) / 100
+    is_face_up[:, :face_up_limit] = rolls <= face_up_chance
+    return is_face_up
+
+
+def calculate_ev(batch: SimulationBatch, value_table: np.ndarray) -> np.ndarray:
+    """
+    Calculates the EV of every round given the face-up cards of that round.
+    """
+    face_up_sum = np.where(batch.is_face_up, batch.values, 0).sum(axis=1)
+    face_up_count = batch.is_face_up.sum(axis=1)
+    face_down = batch.is_face_up.shape[1] - face_up_count
+
+    ev_unseen = (value_table.sum() - face_up_sum) / (len(value_table) - face_up_count)
+    batch.ev = face_up_sum + face_down * ev_unseen
+    return batch.ev
+
+
+def calculate_max_value(batch: SimulationBatch, value_table: np.ndarray) -> np.ndarray:
+    """
+    Calculates the max possible total value of every round given the face-up
+    cards of that round by picking the highest value unseen cards.
+    """
+    order = np.argsort(-value_table, kind='stable')
+    rank_of_card = np.empty_like(order)
+    rank_of_card[order] = np.arange(len(order))
+
+    # Only the highest value cards, one per card in the round, can be picked
+    # because each face-up card removes at most one of them.
+    cards_per_round = batch.cards.shape[1]
+    face_up_rank = np.where(batch.is_face_up, rank_of_card[batch.cards], -1)
+    seen = (face_up_rank[:, :, None] == np.arange(cards_per_round)).any(axis=1)
+    face_down = (~batch.is_face_up).sum(axis=1)
+    picked = (~seen) & (np.cumsum(~seen, axis=1) <= face_down[:, None])
+
+    face_up_sum = np.where(batch.is_face_up, batch.values, 0).sum(axis=1)
+    top_values = value_table[order[:cards_per_round]]
+    batch.max_value = face_up_sum + (picked * top_values).sum(axis=1)
+    return batch.max_value
+
+
+def calculate_spread(batch: SimulationBatch, rng: np.random.Generator) -> None:
+    """
+    Generates a spread for every round given the EV of that round.
+    """
+    offset_limit = np.trunc(batch.ev / 5).astype(int)
+    offset = rng.integers(-offset_limit, offset_limit + 1)
+    spread_width = rng.integers(2, 7, size=len(batch))
+
+    batch.bid = np.trunc(batch.ev + offset - spread_width // 2).astype(int)
+    batch.ask = np.trunc(batch.ev + offset + spread_width // 2).astype(int)
+
+
+def quote_spread(batch: SimulationBatch, value_table: np.ndarray,
+                 config: QuoteConfig, cache: StateCache = None) -> None:
+    """
+    Generates a spread for every round from the distribution of its total
+    value. The distribution only depends on the values of the face-up
+    cards, so it is calculated once for each distinct set of face-up values
+    and every round is quoted in one pass.
+    :param cache: Cache of the distributions by knowledge state, kept 
+                  between chunks
+    """
+    # Face-down cards sort first as -1, so equal rows have equal face-up values
+    keys = np.sort(np.where(batch.is_face_up, batch.values, -1), axis=1)
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+
+    deck_counts = Counter(value_table.tolist())
+    deck_signature = value_signature(deck_counts)
+    cache = cache if cache is not None else StateCache()
+    distributions = []
+    for key in unique_keys.tolist():
+        face_up = [value for value in key if value >= 0]
+        counts = dict(deck_counts - Counter(face_up))
+        face_down = len(key) - len(face_up)
+        # Keyed as Round.cached keys the value distribution of a round
+        distributions.append(cache.get_or_calculate(
+            ('value_distribution', *state_key(deck_signature, counts, sum(face_up), face_down)),
+            lambda: sum_distribution(counts, face_down, offset=sum(face_up))))
+    bid, ask = quote_batch(stack_distributions(distributions), 0, config)
+    batch.bid = bid[inverse.ravel()]
+    batch.ask = ask[inverse.ravel()]
+
+
+def check_order(batch: SimulationBatch, balance) -> np.ndarray:
+    """
+    Checks if each order is valid which is limited by the player balance.
+    Orders which are not valid are passed.
+    """
+    is_buy = (batch.side == BUY) & (batch.ask * batch.units <= balance)
+    is_sell = ((batch.side == SELL)
+               & ((batch.max_value - batch.bid) * batch.units <= balance))
+    batch.is_valid = is_buy | is_sell | (batch.side == PASS)
+    return batch.is_valid
+
+
+def calculate_pl(batch: SimulationBatch) -> np.ndarray:
+    """
+    Calculates the profit/loss for every round given the order and the spread.
+    """
+    total = batch.sum_value
+    pl = np.where(batch.side == BUY, (total - batch.ask) * batch.units,
+                  np.where(batch.side == SELL, (batch.bid - total) * batch.units, 0))
+    batch.pl = np.where(batch.is_valid, pl, 0)
+    return batch.pl
+
+
+def concatenate(batches: list[SimulationBatch]) -> SimulationBatch:
+    """
+    Joins batches of rounds into one batch.
+    :param batches: The list of batches
+    :return:        A single batch with the rounds of every batch in order
+    """
+    joined = SimulationBatch(*(np.concatenate([getattr(batch, name) for batch in batches])
+                               for name in ('cards', 'values', 'is_face_up')))
+    for name in ('ev', 'max_value', 'bid', 'ask', 'side', 'units', 'is_valid', 'pl'):
+        setattr(joined, name, np.concatenate([getattr(batch, name) for batch in batches]))
+    joined.elapsed = sum(batch.elapsed for batch in batches)
+    return joined
+
+
+def simulate_chunk(rng: np.random.Generator, rounds: int, value_table: np.ndarray,
+                   cards_per_round: int, balance, policy,
+                   quoting: QuoteConfig = None, cache: StateCache = None) -> SimulationBatch:
+    """
+    Simulates a batch of independent rounds in one pass.
+    """
+    start = time.perf_counter()
+    cards = deal(rng, rounds, len(value_table), cards_per_round)
+    batch = SimulationBatch(cards, value_table[cards],
+                            rand_face_up(rng, rounds, cards_per_round))
+    calculate_ev(batch, value_table)
+    calculate_max_value(batch, value_table)
+    if quoting is None:
+        calculate_spread(batch, rng)
+    else:
+        quote_spread(batch, value_table, quoting, cache)
+
+    batch.side, batch.units = policy(batch)
+    check_order(batch, balance)
+    calculate_pl(batch)
+    batch.elapsed = time.perf_counter() - start
+    return batch
+
+
+def simulate(rounds: int, ranks: list[str], suits: list[str],
+             card_values: dict[str, int], cards_per_round: int = 3,
+             balance: int = 500, policy=ev_policy, seed=None,
+             chunk_size: int = 100_000, quoting: QuoteConfig = None) -> SimulationBatch:
+    """
+    Simulates a batch of independent rounds.
+    :param rounds:          The number of rounds
+    :param ranks:           The list of ranks
+    :param suits:           The list of suits
+    :param card_values:     Mapping of rank to value
+    :param cards_per_round: The number of cards dealt each round
+    :param balance:         The player balance at the start of each round
+    :param policy:          Callable taking the quoted batch and returning
+                            (side, units) arrays
+    :param seed:            Seed for the random number generator
+    :param chunk_size:      The max number of rounds held in memory per pass
+    :param quoting:         Quote from the value distribution with these 
+                            settings, calculate_spread if None
+    :return:                The simulated batch
+    """
+    rng = np.random.default_rng(seed)
+    value_table = card_value_table(ranks, suits, card_values)
+    cache = StateCache(QUOTE_CACHE_SIZE) if quoting is not None else None
+
+    batches = []
+    for start in range(0, rounds, chunk_size):
+        batches.append(simulate_chunk(rng, min(chunk_size, rounds - start), value_table,
+                                      cards_per_round, balance, policy, quoting, cache))
+    return concatenate(batches)
+
+
+def main() -> None:
+    from game import CARDS_PER_ROUND, RANKS, START_BALANCE, get_deck_spec
+
+    parser = argparse.ArgumentParser(description='Simulate headless rounds')
+    parser.add_argument('--rounds', type=int, default=1_000_000)
+    parser.add_argument('--deck', type=int, default=1, choices=sorted(RANKS))
+    parser.add_argument('--cards', type=int, default=CARDS_PER_ROUND)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--quoting', action='store_true',
+                        help='quote from the value distribution of each round')
+    parser.add_argument('--edge', type=float, default=0.5,
+                        help='quoting edge in standard deviations')
+    parser.add_argument('--quantile', type=float, default=0.25,
+                        help='quoting tail quantile')
+    args = parser.parse_args()
+
+    spec = get_deck_spec(args.deck)
+    quoting = QuoteConfig(args.edge, args.quantile) if args.quoting else None
+    batch = simulate(args.rounds, list(spec.ranks), list(spec.suits), dict(spec.card_values),
+                     args.cards, START_BALANCE, seed=args.seed, quoting=quoting)
+    print(f'Rounds:       {len(batch)}')
+    print(f'Mean P/L:     {batch.pl.mean():.4f}')
+    print(f'Elapsed:      {batch.elapsed:.3f}s')
+    print(f'Rounds/sec:   {batch.rounds_per_second:,.0f}')
+
+
+if __name__ == '__main__':
+    main()
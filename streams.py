@@ -0,0 +1,52 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The streams module creates seeded random number streams for sessions,
+workers and batches. A stream is identified by a root seed and a key, and
+spawning a child stream only appends to the key, so the numbers drawn by a
+stream never depend on how many other streams were spawned or drawn from
+before it. Replaying a session only needs its root seed and key.
+"""
+import random as rand
+from hashlib import sha256
+
+"""
+Class to represent a seeded random number stream which can be split into
+independent child streams.
+"""
+class RandomStream(rand.Random):
+    def __init__(self, seed: int = None, key: str = '') -> None:
+        """
+        :param seed: The root seed, a random seed is chosen if None
+        :param key:  The path of the stream from the root e.g. 'session/3'
+        """
+        if seed is None:
+            seed = rand.SystemRandom().getrandbits(64)
+        self.root_seed: int = seed
+        self.key: str = key
+        super().__init__(f'{seed}/{key}')
+
+    def __repr__(self) -> str:
+        return f'RandomStream({self.root_seed}, {self.key!r})'
+
+    def __reduce__(self) -> tuple:
+        # Keep the seed and key when a stream is sent to a worker process
+        return self.__class__, (self.root_seed, self.key), self.getstate()
+
+    def spawn(self, *keys) -> 'RandomStream':
+        """
+        Creates an independent child stream.
+        :param keys: Names or numbers appended to the key e.g. 'game', 12
+        :return:     The child stream
+        """
+        key = '/'.join([self.key, *map(str, keys)]) if self.key else '/'.join(map(str, keys))
+        return RandomStream(self.root_seed, key)
+
+    def numpy_seed(self) -> int:
+        """
+        Creates a seed for a NumPy Generator of the same stream, e.g.
+        np.random.default_rng(stream.numpy_seed()).
+        """
+        digest = sha256(f'{self.root_seed}/{self.key}'.encode()).digest()
+        return int.from_bytes(digest[:16], 'little')
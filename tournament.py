@@ -0,0 +1,403 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The tournament module ranks automated trading strategies against the market
+maker. Each strategy plays many full games with the same rules as game.main
+and the games are split across a process pool. Every game plays with the
+random stream 'strategy/game number' of the tournament seed so a tournament
+can be replayed and each game is independent of which process played it.
+
+A strategy sees what a player sees: the cards shown each round, the market
+maker quote, its balance and any market event, along with the EV of the
+round from every card seen this game as a player counting cards would.
+Strategies are given by name from STRATEGIES or as module:Class for a
+Strategy subclass in another module.
+"""
+import argparse
+import importlib
+import random as rand
+import time
+from concurrent import futures
+
+import game
+import validation
+from cache import shared_cache
+from deck import DeckSpec
+from player import Player
+from streams import RandomStream
+
+# Number of games played by each task sent to the pool
+CHUNK_SIZE = 50
+
+"""
+Class to represent what a player sees when placing an order.
+"""
+class RoundView:
+    __slots__ = ('round_num', 'cards', 'bid', 'ask', 'balance', 'event', 'ev')
+
+    def __init__(self, round_num=1, cards='', bid=0, ask=0, balance=0, event=None,
+                 ev=0.0) -> None:
+        """
+        :param round_num: The round number
+        :param cards:     The cards as shown by Round.show_round, -- if face-down
+        :param bid:       The market maker bid
+        :param ask:       The market maker ask
+        :param balance:   The player balance
+        :param event:     The market event description, None if no event
+        :param ev:        The EV of the round given the cards seen this game,
+                          from Round.calculate_ev
+        """
+        self.round_num: int = round_num
+        self.cards: str = cards
+        self.bid: int = bid
+        self.ask: int = ask
+        self.balance: int = balance
+        self.event: str = event
+        self.ev: float = ev
+
+
+"""
+Class to represent an automated trading strategy. Subclasses override order
+and may override new_game and reveal to track the cards seen in a game.
+"""
+class Strategy:
+    name = 'strategy'
+
+    def __init__(self, ranks: list[str], suits: list[str], card_values: dict[str, int],
+                 rng: rand.Random) -> None:
+        """
+        :param ranks:       The list of ranks
+        :param suits:       The list of suits
+        :param card_values: Mapping of rank to value
+        :param rng:         Random number generator of the strategy
+        """
+        self.ranks: list[str] = ranks
+        self.suits: list[str] = suits
+        self.card_values: dict[str, int] = card_values
+        self.rng: rand.Random = rng
+
+    def new_game(self) -> None:
+        """
+        Called before the first round of each game.
+        """
+
+    def order(self, view: RoundView) -> tuple[str, int]:
+        """
+        Decides the order for a round.
+        :param view: What the player sees
+        :return:     Tuple ('Buy'|'Sell'|'Pass', units)
+        """
+        raise NotImplementedError
+
+    def reveal(self, cards: str) -> None:
+        """
+        Called with every card of a round once they are revealed.
+        :param cards: The cards as shown by Round.reveal_all_cards
+        """
+
+
+"""
+Class to represent a strategy which never trades.
+"""
+class PassStrategy(Strategy):
+    name = 'pass'
+
+    def order(self, view: RoundView) -> tuple[str, int]:
+        return 'Pass', 0
+
+
+"""
+Class to represent a strategy which trades at random.
+"""
+class RandomStrategy(Strategy):
+    name = 'random'
+    MAX_UNITS = 5
+
+    def order(self, view: RoundView) -> tuple[str, int]:
+        action = self.rng.choice(('Buy', 'Sell', 'Pass'))
+        return action, 0 if action == 'Pass' else self.rng.randint(1, self.MAX_UNITS)
+
+
+"""
+Class to represent a strategy which trades when the EV of the round is
+outside the quote. The EV counts the cards revealed in earlier rounds of the
+game as seen, like the market maker does, so it holds for any deck, shoe
+or market event.
+"""
+class EVStrategy(Strategy):
+    name = 'ev'
+    UNITS = 5
+    EDGE = 0
+
+    def order(self, view: RoundView) -> tuple[str, int]:
+        ev = view.ev
+        if ev > view.ask + self.EDGE:
+            return 'Buy', self.units(ev - view.ask)
+        if ev < view.bid - self.EDGE:
+            return 'Sell', self.units(view.bid - ev)
+        return 'Pass', 0
+
+    def units(self, edge: float) -> int:
+        return self.UNITS
+
+
+"""
+Class to represent the EV strategy which sizes orders by its edge.
+"""
+class ScaledEVStrategy(EVStrategy):
+    name = 'scaled-ev'
+    MAX_UNITS = 20
+
+    def units(self, edge: float) -> int:
+        return max(1, min(self.MAX_UNITS, int(edge * 2)))
+
+
+STRATEGIES = {strategy.name: strategy for strategy in
+              (PassStrategy, RandomStrategy, EVStrategy, ScaledEVStrategy)}
+
+
+def load_strategy(name: str) -> type[Strategy]:
+    """
+    Looks up a strategy by name or imports it from module:Class.
+    :param name: The strategy name
+    :return:     The Strategy subclass
+    """
+    if name in STRATEGIES:
+        return STRATEGIES[name]
+    if ':' not in name:
+        raise ValueError(f'Strategy must be one of {", ".join(STRATEGIES)} or module:Class')
+    module_name, class_name = name.split(':', 1)
+    strategy = getattr(importlib.import_module(module_name), class_name)
+    # Checked by interface as this module may also be loaded as __main__
+    if not (isinstance(strategy, type) and callable(getattr(strategy, 'order', None))):
+        raise ValueError(f'{name} is not a Strategy')
+    return strategy
+
+
+"""
+Class to represent the result of a game.
+"""
+class GameResult:
+    __slots__ = ('pl', 'rounds', 'trades', 'wins', 'rejected', 'max_drawdown')
+
+    def __init__(self, pl=0, rounds=0, trades=0, wins=0, rejected=0, max_drawdown=0) -> None:
+        """
+        :param pl:           The final balance less the start balance
+        :param rounds:       The number of rounds played
+        :param trades:       The number of rounds with a buy or sell
+        :param wins:         The number of trades with a profit
+        :param rejected:     The number of orders which exceeded the balance
+        :param max_drawdown: The largest fall of the balance from its high
+        """
+        self.pl: int = pl
+        self.rounds: int = rounds
+        self.trades: int = trades
+        self.wins: int = wins
+        self.rejected: int = rejected
+        self.max_drawdown: int = max_drawdown
+
+
+def play_game(strategy: Strategy, spec: DeckSpec, rng: RandomStream) -> GameResult:
+    """
+    Plays a full game with a strategy placing the orders.
+    :param strategy: The strategy
+    :param spec:     The compiled deck
+    :param rng:      Random number generator of the game
+    :return:         The result of the game
+    """
+    game_deck, knowledge = game.new_game_deck(spec, rng)
+    player = Player(game.START_BALANCE)
+    seen_cards = set()
+    cache = shared_cache if game.CACHE else None
+    strategy.new_game()
+
+    result = GameResult()
+    high = player.balance
+    curr_round = 1
+    while curr_round <= game.ROUNDS and len(game_deck) > 0:
+        round = game.deal_round(curr_round, game_deck, spec, knowledge, seen_cards, cache,
+                                rng=rng)
+        view = RoundView(curr_round, round.show_round(), balance=player.balance,
+                         event=str(round.market_event) if round.market_event else None)
+        view.ev = round.calculate_ev()
+        view.bid, view.ask = round.calculate_spread()
+        round.player_start_bal = player.balance
+
+        action, units = strategy.order(view)
+        if action != 'Pass' and (action not in validation.ORDER_TYPES.values() or units <= 0):
+            raise ValueError(f'{strategy.name} placed an invalid order {action} {units}')
+        if action != 'Pass' and not round.place_order(action, units):
+            # The console game asks again, a strategy passes instead
+            result.rejected += 1
+            round.place_order('Pass', 0)
+
+        strategy.reveal(round.reveal_all_cards())
+        round.player_input_pl = round.calculate_pl()
+        player.balance += round.player_true_pl
+        round.player_end_bal = player.balance
+
+        result.rounds += 1
+        if round.order != 'Pass':
+            result.trades += 1
+            result.wins += round.player_true_pl > 0
+        high = max(high, player.balance)
+        result.max_drawdown = max(result.max_drawdown, high - player.balance)
+        round.clear_cards()
+        curr_round += 1
+
+    result.pl = player.balance - game.START_BALANCE
+    return result
+
+
+def play_games(name: str, seed: int, start: int, count: int,
+               deck=game.DECK) -> list[GameResult]:
+    """
+    Plays a chunk of games of one strategy. Runs in a worker process.
+    :param name:  The strategy name
+    :param seed:  The tournament seed
+    :param start: The number of the first game
+    :param count: The number of games
+    :param deck:  Key of game.RANKS or the path of a deck configuration file
+    :return:      List of results in game order
+    """
+    spec = game.get_deck_spec(deck)
+    ranks, suits, values = list(spec.ranks), list(spec.suits), dict(spec.card_values)
+    results = []
+    root = RandomStream(seed)
+    for game_num in range(start, start + count):
+        rng = root.spawn(name, game_num)
+        strategy = load_strategy(name)(ranks, suits, values, rng.spawn('strategy'))
+        results.append(play_game(strategy, spec, rng))
+    return results
+
+
+"""
+Class to represent the combined results of a strategy.
+"""
+class Standing:
+    def __init__(self, name: str) -> None:
+        self.name: str = name
+        self.games: int = 0
+        self.pl_sum: int = 0
+        self.pl_sq_sum: int = 0
+        self.rounds: int = 0
+        self.trades: int = 0
+        self.wins: int = 0
+        self.rejected: int = 0
+        self.drawdown_sum: int = 0
+        self.max_drawdown: int = 0
+        self.ruined: int = 0
+
+    def add(self, result: GameResult) -> None:
+        self.games += 1
+        self.pl_sum += result.pl
+        self.pl_sq_sum += result.pl * result.pl
+        self.rounds += result.rounds
+        self.trades += result.trades
+        self.wins += result.wins
+        self.rejected += result.rejected
+        self.drawdown_sum += result.max_drawdown
+        self.max_drawdown = max(self.max_drawdown, result.max_drawdown)
+        self.ruined += result.pl <= -game.START_BALANCE
+
+    def mean_pl(self) -> float:
+        return self.pl_sum / self.games if self.games else 0
+
+    def std_pl(self) -> float:
+        if self.games < 2:
+            return 0
+        variance = (self.pl_sq_sum - self.pl_sum ** 2 / self.games) / (self.games - 1)
+        return max(variance, 0) ** 0.5
+
+    def hit_rate(self) -> float:
+        return self.wins / self.trades if self.trades else 0
+
+    def to_dict(self) -> dict:
+        return {'strategy': self.name,
+                'games': self.games,
+                'mean_pl': self.mean_pl(),
+                'std_pl': self.std_pl(),
+                'hit_rate': self.hit_rate(),
+                'trade_rate': self.trades / self.rounds if self.rounds else 0,
+                'mean_max_drawdown': self.drawdown_sum / self.games if self.games else 0,
+                'max_drawdown': self.max_drawdown,
+                'ruin_rate': self.ruined / self.games if self.games else 0,
+                'rejected': self.rejected}
+
+
+def run_tournament(strategies: list[str], games: int, processes: int = None,
+                   seed: int = 0, chunk_size: int = CHUNK_SIZE,
+                   deck=game.DECK) -> list[Standing]:
+    """
+    Plays games of every strategy across a process pool.
+    :param strategies: List of strategy names
+    :param games:      The number of games per strategy
+    :param processes:  The number of worker processes, one per CPU if None
+                       and the games are played in this process if 1
+    :param seed:       The tournament seed
+    :param chunk_size: The number of games played by each task
+    :param deck:       Key of game.RANKS or the path of a deck configuration file
+    :return:           Leaderboard of standings sorted by mean P/L
+    """
+    for name in strategies:
+        load_strategy(name)
+    standings = {name: Standing(name) for name in strategies}
+    tasks = [(name, seed, start, min(chunk_size, games - start), deck)
+             for name in strategies for start in range(0, games, chunk_size)]
+
+    if processes == 1:
+        for task in tasks:
+            for result in play_games(*task):
+                standings[task[0]].add(result)
+    else:
+        with futures.ProcessPoolExecutor(processes) as executor:
+            for task, results in zip(tasks, executor.map(play_games, *zip(*tasks))):
+                for result in results:
+                    standings[task[0]].add(result)
+
+    return sorted(standings.values(), key=lambda standing: standing.mean_pl(), reverse=True)
+
+
+def print_leaderboard(standings: list[Standing]) -> None:
+    print(f'{"#":<3}{"Strategy":<16}{"Games":>8}{"Mean P/L":>11}{"Std P/L":>10}'
+          f'{"Hit rate":>10}{"Mean DD":>10}{"Max DD":>8}{"Ruin":>7}')
+    for rank, standing in enumerate(standings, 1):
+        stats = standing.to_dict()
+        print(f'{rank:<3}{standing.name:<16}{stats["games"]:>8}{stats["mean_pl"]:>11.2f}'
+              f'{stats["std_pl"]:>10.2f}{stats["hit_rate"]:>10.1%}'
+              f'{stats["mean_max_drawdown"]:>10.1f}{stats["max_drawdown"]:>8}'
+              f'{stats["ruin_rate"]:>7.1%}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Rank trading strategies against '
+                                                 'the market maker')
+    parser.add_argument('strategies', nargs='*', default=list(STRATEGIES),
+                        help='strategy names or module:Class, every built-in strategy '
+                             'by default')
+    parser.add_argument('--games', type=int, default=1000, help='games per strategy')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes, one per CPU by default')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--deck', type=int, default=game.DECK, choices=sorted(game.RANKS))
+    parser.add_argument('--deck-config', default=None,
+                        help='JSON or TOML deck configuration file, instead of --deck')
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else RandomStream().root_seed
+    deck = args.deck_config if args.deck_config else args.deck
+    start = time.perf_counter()
+    standings = run_tournament(args.strategies, args.games, args.processes, seed,
+                               args.chunk_size, deck)
+    elapsed = time.perf_counter() - start
+
+    print_leaderboard(standings)
+    total = args.games * len(args.strategies)
+    print(f'\nSeed: {seed}  Games: {total}  Elapsed: {elapsed:.2f}s  '
+          f'Games/sec: {total / elapsed:,.0f}')
+
+
+if __name__ == '__main__':
+    main()
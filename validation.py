@@ -1,2 +1,48 @@
+"""
+Alson Lee
+Date: 18/10/26
+
+The validation module parses player input for the market making card game.
+"""
+import re
+
+ORDER_PATTERN = re.compile(r'[bs][,][1-9]\d*')
+PL_PATTERN = re.compile(r'[-]?[1-9]+\d*')
+
+ORDER_TYPES = {'b': 'Buy', 's': 'Sell'}
+
+
+def parse_order(action: str) -> tuple[str, int]:
+    """
+    Parses an order e.g. B,10 or S,5 or P.
+    :param action: The player input
+    :return:       Tuple (order, units) where order is 'Buy', 'Sell', 'Pass'
+                   or 'Next' or None if the input is not valid
+    """
+    action = action.lower().strip()
+    if action == 'p':
+        return 'Pass', 0
+    if action == 'n':
+        return 'Next', 0
+
+    match = ORDER_PATTERN.match(action)
+    if match:
+        order, units = match.group().split(',')
+        return ORDER_TYPES[order], int(units)
+    return None
+
+
+def parse_pl(report: str) -> int:
+    """
+    Parses a reported profit/loss e.g. 10 or -5.
+    :param report: The player input
+    :return:       The profit/loss or None if the input is not valid
+    """
+    match = PL_PATTERN.match(report)
+    if match:
+        return int(match.group())
+    return None
+
+
 def is_valid_action(action: str) -> bool:
-    pass
+    return parse_order(action) is not None